@@ -0,0 +1,98 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+""" Compares time of generating compressed snapshots by external
+    compressor (snapshot_threads = 0) and by in-process compression on a
+    pool of threads (see compress.py). Each snapshot is decompressed and
+    checked against output of git archive.
+
+    Usage: python bench_compress.py repo.git [rev [threads ...]]
+"""
+
+import sys
+import time
+from subprocess import Popen, PIPE
+
+import git
+import compress
+
+
+decompressors = { 'tgz'  : ['gzip', '-dc'],
+                  'tbz2' : ['bzip2', '-dc'],
+                  'txz'  : ['xz', '-dc'] }
+
+def decompress(type, data):
+    pipe = Popen(decompressors[type], stdin = PIPE, stdout = PIPE)
+    return pipe.communicate(data)[0]
+
+def bench(g, rev, type, threads, repeat = 3):
+    """ Returns (best time in seconds, size of snapshot, snapshot) """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        data, filename = g.archive(rev, 'bench', type, threads)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, len(data), data, )
+
+def main(argv):
+    if len(argv) < 2:
+        print >>sys.stderr, 'Usage: {0} repo.git [rev [threads ...]]'.format(argv[0])
+        return 1
+
+    g = git.Git(argv[1])
+    rev = 'HEAD'
+    if len(argv) > 2:
+        rev = argv[2]
+    threads = [int(t) for t in argv[3:]] or [2, 4, 8]
+
+    tar = g._git.archive(rev, 'tar', 'bench-' + rev + '/')
+    print 'tar: {0} bytes'.format(len(tar))
+
+    ok = True
+    for type in ['tgz', 'tbz2', 'txz']:
+        if type == 'txz' and not compress.supported('xz'):
+            print '{0}: lzma module not available, skipped'.format(type)
+            continue
+
+        base = None
+        for t in [0] + threads:
+            elapsed, size, data = bench(g, rev, type, t)
+            same = decompress(type, data) == tar
+            ok = ok and same
+
+            if t == 0:
+                base = elapsed
+                name = 'external'
+            else:
+                name = '{0} threads'.format(t)
+            print '{0:5} {1:11} {2:8.3f} s {3:6.2f}x {4:10} bytes {5}'.format(
+                        type, name, elapsed, base / elapsed, size,
+                        same and 'ok' or 'MISMATCH')
+
+    if ok:
+        return 0
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,103 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+""" Micro-benchmark of Git.commitsSetRefs() on synthetic refs: decorating
+    one page of commits by scanning all refs for each commit compared with
+    lookup in index of refs (built once per refs snapshot).
+
+    Usage: python bench_refs.py [commits_per_page [number_of_tags ...]]
+"""
+
+import sys
+import time
+
+import git
+
+
+def _id(i):
+    return '{0:040x}'.format(i)
+
+def scanRefs(commits, tags, heads, remotes):
+    """ Decorates commits by comparing every commit with every ref """
+    out = []
+    for c in commits:
+        out.append(([t for t in tags if t.objid == c.id],
+                    [h for h in heads if h.id == c.id],
+                    [r for r in remotes if r.id == c.id]))
+    return out
+
+def measure(fn, repeat):
+    start = time.time()
+    for i in range(repeat):
+        res = fn()
+    return ((time.time() - start) / repeat, res, )
+
+def main(argv):
+    per_page = 50
+    sizes = [100, 1000, 5000, 20000]
+    if len(argv) > 1:
+        per_page = int(argv[1])
+    if len(argv) > 2:
+        sizes = [int(n) for n in argv[2:]]
+
+    # refs_cache is keyed by directory, nothing is read from it
+    g = git.Git('/nonexistent/bench-refs.git')
+    commits = [git.GitCommit(g, _id(i), None, [], None, None, '') \
+                for i in range(per_page)]
+
+    print '{0} commits per page'.format(per_page)
+    print '{0:>8} {1:>12} {2:>12} {3:>12}'.format('refs', 'scan [ms]',
+                                                  'build [ms]', 'index [ms]')
+    ok = True
+    for n in sizes:
+        # every 7th commit is tagged, every 3rd one has a head
+        tags    = [git.GitTag(g, _id(i * 7), objid = _id(i * 7),
+                              name = 't{0}'.format(i)) for i in range(n)]
+        heads   = [git.GitHead(g, _id(i * 3), name = 'h{0}'.format(i)) \
+                    for i in range(n // 10)]
+        remotes = [git.GitHead(g, _id(i * 5), name = 'r{0}'.format(i)) \
+                    for i in range(n // 10)]
+        git.refs_cache[g._dir] = [None, (tags, heads, remotes), None]
+
+        repeat = max(1, 200000 // (n * per_page))
+        scan, expected = measure(lambda: scanRefs(commits, tags, heads,
+                                                  remotes), repeat)
+
+        start = time.time()
+        g.commitsSetRefs(commits, tags, heads, remotes)
+        build = time.time() - start
+
+        index, res = measure(lambda: g.commitsSetRefs(commits, tags, heads,
+                                                      remotes), 100)
+        ok = ok and [(c.tags, c.heads, c.remotes) for c in res] == expected
+
+        print '{0:8} {1:12.3f} {2:12.3f} {3:12.3f}'.format(len(tags) + len(heads) + len(remotes),
+                                                           scan * 1000., build * 1000.,
+                                                           index * 1000.)
+
+    if not ok:
+        print 'MISMATCH between scan and index'
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
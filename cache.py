@@ -0,0 +1,322 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import os
+import time
+import errno
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import collections
+
+
+class LRUCache(object):
+    """ In-memory cache holding at most max_items items. Least recently
+        used items are dropped first. Numbers of hits and misses are
+        counted in attributes hits and misses.
+    """
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.hits   = 0
+        self.misses = 0
+
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default = None):
+        self._lock.acquire()
+        try:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._items[key] = value
+            self.hits += 1
+            return value
+        finally:
+            self._lock.release()
+
+    def getMany(self, keys):
+        """ Returns dictionary of cached keys and their values """
+        out = {}
+        self._lock.acquire()
+        try:
+            for key in keys:
+                try:
+                    value = self._items.pop(key)
+                except KeyError:
+                    self.misses += 1
+                    continue
+
+                self._items[key] = value
+                self.hits += 1
+                out[key] = value
+        finally:
+            self._lock.release()
+        return out
+
+    def put(self, key, value):
+        self._lock.acquire()
+        try:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.max_items:
+                self._items.popitem(last = False)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._items.clear()
+        finally:
+            self._lock.release()
+
+
+class DiskCacheWriter(object):
+    """ Writes one entry of DiskCache. Data are written into temporary file
+        which is renamed to its final name by commit(), so nobody can see
+        partially written entry.
+    """
+
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._path = cache.path(key)
+
+        fd, self._tmp = tempfile.mkstemp(prefix = '.tmp-', dir = cache.dir)
+        os.chmod(self._tmp, 0644)
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, s):
+        self._file.write(s)
+
+    def commit(self):
+        self._file.close()
+        os.rename(self._tmp, self._path)
+        self._cache.evict()
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.unlink(self._tmp)
+        except OSError:
+            pass
+
+
+class DiskCache(object):
+    """ Cache storing each entry in its own file in one directory.
+
+        Total size of all entries is limited by max_size (in bytes), when
+        the limit is exceeded least recently used entries are removed.
+        Modification time of a file is used as time of its last use so the
+        cache can be shared by several processes.
+    """
+
+    def __init__(self, dir, max_size):
+        self.dir = dir
+        self.max_size = max_size
+
+        try:
+            os.makedirs(self.dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def path(self, key):
+        return os.path.join(self.dir, hashlib.sha1(key).hexdigest())
+
+    def get(self, key):
+        """ Returns pathname of file with entry or None if key isn't
+            cached.
+        """
+        path = self.path(key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def read(self, key):
+        """ Returns cached data or None """
+        path = self.get(key)
+        if not path:
+            return None
+
+        try:
+            f = open(path, 'rb')
+            try:
+                return f.read()
+            finally:
+                f.close()
+        except IOError:
+            return None
+
+    def writer(self, key):
+        return DiskCacheWriter(self, key)
+
+    def put(self, key, data):
+        w = self.writer(key)
+        try:
+            w.write(data)
+        except:
+            w.abort()
+            raise
+        w.commit()
+
+    def evict(self):
+        """ Removes least recently used entries until total size fits into
+            max_size.
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.dir):
+            path = os.path.join(self.dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            if name[:5] == '.tmp-':
+                # leftover of crashed writer
+                if st.st_mtime < now - 3600:
+                    self._unlink(path)
+                continue
+
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            self._unlink(path)
+            total -= size
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class SQLiteCache(object):
+    """ Persistent map of keys to small values (e.g. sizes of blobs) stored
+        in SQLite database path. Values are never invalidated so it is
+        meant for data derived from immutable objects.
+
+        Size of the database (in bytes) is limited by max_size, when the
+        limit is exceeded least recently used entries are removed. Time of
+        last use is updated at most once per hour so lookups don't write
+        to the database each time.
+
+        Errors of the database are not reported, failed lookup is a miss
+        and failed store is ignored.
+    """
+
+    def __init__(self, path, max_size):
+        self.max_size = max_size
+
+        self._db = sqlite3.connect(path, timeout = 5)
+        self._db.text_factory = str
+
+        # database of older version without time of last use is dropped
+        columns = [c[1] for c in self._db.execute('PRAGMA table_info(cache)')]
+        if len(columns) > 0 and 'used' not in columns:
+            self._db.execute('DROP TABLE cache')
+
+        self._db.execute('''CREATE TABLE IF NOT EXISTS cache (
+                                key   TEXT PRIMARY KEY,
+                                value,
+                                used  INTEGER)''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def getMany(self, keys):
+        """ Returns dictionary of cached keys and their values """
+        out = {}
+        now = int(time.time())
+        try:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                sql  = 'SELECT key, value, used FROM cache WHERE key IN ('
+                sql += ','.join(['?'] * len(batch)) + ')'
+                stale = []
+                for key, value, used in self._db.execute(sql, batch):
+                    out[key] = value
+                    if used < now - 3600:
+                        stale.append((now, key))
+
+                if len(stale) > 0:
+                    self._db.executemany('UPDATE cache SET used = ? WHERE key = ?',
+                                         stale)
+                    self._db.commit()
+        except sqlite3.Error:
+            self._rollback()
+        return out
+
+    def putMany(self, items):
+        """ Stores list of (key, value) pairs """
+        now = int(time.time())
+        try:
+            self._db.executemany('INSERT OR REPLACE INTO cache (key, value, used) VALUES (?, ?, ?)',
+                                 [(key, value, now) for key, value in items])
+            self._db.commit()
+            self.evict()
+        except sqlite3.Error:
+            self._rollback()
+
+    def evict(self):
+        """ Removes least recently used entries until size of the database
+            fits into max_size. Some more entries are removed, so it doesn't
+            happen on each store.
+        """
+        page_size = self._db.execute('PRAGMA page_size').fetchone()[0]
+        pages = self._db.execute('PRAGMA page_count').fetchone()[0]
+        free = self._db.execute('PRAGMA freelist_count').fetchone()[0]
+        size = (pages - free) * page_size
+        if size <= self.max_size:
+            return
+
+        # pages freed by removed entries are reused by new ones
+        count = self._db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        remove = count - int(count * 0.9 * self.max_size / size)
+        self._db.execute('''DELETE FROM cache WHERE key IN (
+                                SELECT key FROM cache ORDER BY used LIMIT ?)''',
+                         (remove, ))
+        self._db.commit()
+
+    def _rollback(self):
+        try:
+            self._db.rollback()
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,198 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+""" Checks that pages of log listed by cursor (Git.revListFrom(), falling
+    back to skip the same way as Project.log() does) put together give the
+    same list of commits as git rev-list. Synthetic repositories with clock
+    skew, commits of the same date and many merges are created in temporary
+    directory, other repositories can be given on command line.
+
+    Usage: python check_log_cursor.py [repo.git ...]
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+from subprocess import Popen, PIPE
+
+import git
+
+
+class Repo(object):
+    """ Builds history of empty commits with given committer dates """
+
+    def __init__(self, dir):
+        self.dir = dir
+        self._git(['init', '--bare', '-q', dir], git_dir = False)
+        self._tree = self._git(['hash-object', '-t', 'tree', '-w', '--stdin'], '')
+
+    def _git(self, args, input = None, env = None, git_dir = True):
+        comm = ['git']
+        if git_dir:
+            comm.append('--git-dir={0}'.format(self.dir))
+        e = dict(os.environ)
+        e.update(env or {})
+        pipe = Popen(comm + args, stdin = PIPE, stdout = PIPE, env = e)
+        return pipe.communicate(input)[0].strip()
+
+    def commit(self, name, date, parents = []):
+        date = '@{0} +0000'.format(date)
+        env = { 'GIT_AUTHOR_NAME'     : 'Tester',
+                'GIT_AUTHOR_EMAIL'    : 'tester@example.com',
+                'GIT_AUTHOR_DATE'     : date,
+                'GIT_COMMITTER_NAME'  : 'Tester',
+                'GIT_COMMITTER_EMAIL' : 'tester@example.com',
+                'GIT_COMMITTER_DATE'  : date }
+        args = ['commit-tree', self._tree]
+        for p in parents:
+            args += ['-p', p]
+        return self._git(args, name, env)
+
+    def setHead(self, id):
+        self._git(['update-ref', 'refs/heads/master', id])
+
+    def writeCommitGraph(self):
+        self._git(['commit-graph', 'write', '--reachable'])
+
+
+def skewed(dir):
+    """ A(1000) <- B(5000) <- X(2000) <- C(6000) -> D(3000) -> A """
+    r = Repo(dir)
+    a = r.commit('A', 1000)
+    b = r.commit('B', 5000, [a])
+    x = r.commit('X', 2000, [b])
+    d = r.commit('D', 3000, [a])
+    r.setHead(r.commit('C', 6000, [x, d]))
+    return r
+
+def sameDate(dir):
+    """ Two branches merged back and forth, all commits of the same date """
+    r = Repo(dir)
+    left = right = r.commit('root', 1000)
+    for i in range(10):
+        left  = r.commit('l{0}'.format(i), 1000, [left])
+        right = r.commit('r{0}'.format(i), 1000, [right])
+        if i % 3 == 2:
+            left = r.commit('m{0}'.format(i), 1000, [left, right])
+    r.setHead(r.commit('top', 1000, [left, right]))
+    return r
+
+def merges(dir, skew):
+    """ Several branches merged randomly, with skew some commits are older
+        than their parents.
+    """
+    rnd = random.Random(skew and 1 or 2)
+    r = Repo(dir)
+    date = 100000
+    tips = [r.commit('root', date)]
+    for i in range(300):
+        date += rnd.randint(0, 3) * 10
+        d = date
+        if skew and rnd.random() < 0.1:
+            d -= rnd.randint(1, 2000)
+
+        heads = sorted(set(tips))
+        if len(heads) > 1 and rnd.random() < 0.3:
+            p = rnd.sample(heads, 2)
+            tips = [t for t in tips if t != p[1]]
+        else:
+            p = [rnd.choice(tips)]
+        c = r.commit('c{0}'.format(i), d, p)
+        tips[tips.index(p[0])] = c
+
+        if rnd.random() < 0.1:
+            tips.append(c)
+
+    r.setHead(r.commit('top', date + 10, sorted(set(tips))))
+    return r
+
+
+def pagedLog(g, per_page):
+    """ Returns list of ids of commits listed page by page the same way as
+        Project.log() with log_cursor enabled.
+    """
+    out = []
+    page = 1
+    cursor = ['HEAD']
+    listed = []
+    while True:
+        res = None
+        if cursor:
+            res = g.revListFrom(cursor, per_page, listed)
+
+        next = None
+        if res is not None:
+            commits, next, listed = res
+        else:
+            commits = g.revList('HEAD', max_count = per_page,
+                                skip = per_page * (page - 1))
+        if next is not None and len(next) + len(listed) > 20:
+            next = None
+
+        out += [c.id for c in commits]
+        if next == [] or (next is None and len(commits) < per_page):
+            return out
+        cursor = next
+        page += 1
+
+def check(dir, out = sys.stdout):
+    """ Returns True if paged log of repository in dir is correct """
+    expected = git.GitComm(dir).revList('HEAD').split()
+    g = git.Git(dir)
+
+    ok = True
+    for per_page in [1, 2, 3, 5, 50]:
+        got = pagedLog(g, per_page)
+        if got != expected:
+            ok = False
+            print >>out, '{0}: {1} per page: {2} commits listed, {3} expected ({4} unique)'.format(
+                            dir, per_page, len(got), len(expected), len(set(got)))
+    return ok
+
+def main(argv):
+    ok = True
+    tmp = tempfile.mkdtemp(prefix = 'pitweb-log-')
+    try:
+        repos = [skewed, sameDate, lambda d: merges(d, False),
+                 lambda d: merges(d, True)]
+        for i, create in enumerate(repos):
+            for graph in [False, True]:
+                dir = os.path.join(tmp, '{0}-{1}.git'.format(i, graph))
+                r = create(dir)
+                if graph:
+                    r.writeCommitGraph()
+                ok = check(dir) and ok
+
+        for dir in argv[1:]:
+            ok = check(dir) and ok
+    finally:
+        shutil.rmtree(tmp)
+
+    if not ok:
+        return 1
+    print 'ok'
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
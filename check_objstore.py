@@ -0,0 +1,102 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+""" Checks that native object store backend (objstore.GitNative) gives the
+    same output as git commands (git.GitComm) for every object and ref of
+    given repositories.
+
+    Usage: python check_objstore.py repo.git [repo.git ...]
+"""
+
+import sys
+
+import git
+import objstore
+
+
+class Checker(object):
+    def __init__(self, dir, out = sys.stdout):
+        self._dir = dir
+        self._git = git.GitComm(dir)
+        self._native = objstore.GitNative(dir)
+        self._out = out
+        self.checks = 0
+        self.failures = 0
+
+    def _check(self, what, method, *args, **kwargs):
+        expected = getattr(self._git, method)(*args, **kwargs)
+        got = getattr(self._native, method)(*args, **kwargs)
+
+        self.checks += 1
+        if expected != got:
+            self.failures += 1
+            print >>self._out, '{0}: {1} differs'.format(self._dir, what)
+
+    def _objects(self):
+        out = self._git._git(['rev-list', '--objects', '--all'])
+        return [line.split(' ', 1) + [''] for line in out.splitlines()]
+
+    def run(self):
+        refs = self._native._store.refs()
+
+        self._check('rev-list --all', 'revList', None, parents = True,
+                    header = True, all = True)
+        for ref in ['HEAD'] + sorted(refs.keys()):
+            self._check('rev-list ' + ref, 'revList', ref, parents = True)
+            self._check('rev-list --skip=3 --max-count=5 ' + ref, 'revList',
+                        ref, max_count = 5, skip = 3)
+            self._check('cat-file --batch ' + ref, 'catFileBatch', ref)
+
+        for obj in self._objects():
+            id, path = obj[0], obj[1]
+            self._check('cat-file --batch ' + id, 'catFileBatch', id)
+            self._check('cat-file --batch-check ' + id, 'catFileBatchCheck', id)
+
+            if len(path) > 0:
+                name = 'HEAD:' + path
+                self._check('cat-file --batch ' + name, 'catFileBatch', name)
+
+        for id in self._git.revList(None, all = True).split():
+            self._check('ls-tree ' + id, 'lsTree', id, recursive = True,
+                        long = True, full_tree = True, trees = True)
+
+        return self.failures == 0
+
+
+def main(argv):
+    if len(argv) < 2:
+        print >>sys.stderr, 'Usage: {0} repo.git [repo.git ...]'.format(argv[0])
+        return 1
+
+    ok = True
+    for dir in argv[1:]:
+        checker = Checker(dir)
+        ok = checker.run() and ok
+        print '{0}: {1} checks, {2} failed'.format(dir, checker.checks,
+                                                   checker.failures)
+
+    if ok:
+        return 0
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,254 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import os
+import mmap
+import struct
+import binascii
+import threading
+
+
+PARENT_NONE        = 0x70000000
+PARENT_EXTRA_EDGES = 0x80000000
+PARENT_LAST_EDGE   = 0x80000000
+
+CDAT_SIZE = 36
+
+
+class CommitGraphFile(object):
+    """ One commit-graph file (see gitformat-commit-graph(5)).
+
+        Positions of commits are global within the whole chain of graph
+        files, base_num is number of commits stored in all base files.
+    """
+
+    def __init__(self, path, base_num = 0):
+        f = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        self.base_num = base_num
+
+        if self._map[:4] != 'CGPH':
+            raise ValueError('{0} is not commit-graph file'.format(path))
+        version, hash_version, num_chunks = struct.unpack('BBB', self._map[4:7])
+        if version != 1 or hash_version != 1:
+            raise ValueError('Unsupported version of commit-graph {0}'.format(path))
+
+        chunks = {}
+        for i in range(num_chunks):
+            pos = 8 + i * 12
+            id, offset = struct.unpack('>4sQ', self._map[pos:pos + 12])
+            chunks[id] = offset
+
+        for id in ['OIDF', 'OIDL', 'CDAT']:
+            if id not in chunks:
+                raise ValueError('Missing {0} chunk in {1}'.format(id, path))
+
+        self._fanout = struct.unpack('>256I', self._map[chunks['OIDF']:chunks['OIDF'] + 1024])
+        self.num = self._fanout[255]
+        self._oidl = chunks['OIDL']
+        self._cdat = chunks['CDAT']
+        self._edge = chunks.get('EDGE')
+
+    def position(self, sha):
+        """ Returns global position of commit with binary id sha or None """
+        first = ord(sha[0])
+        lo = 0
+        if first > 0:
+            lo = self._fanout[first - 1]
+        hi = self._fanout[first]
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._oidl + mid * 20
+            name = self._map[pos:pos + 20]
+            if name < sha:
+                lo = mid + 1
+            elif name > sha:
+                hi = mid
+            else:
+                return self.base_num + mid
+        return None
+
+    def id(self, pos):
+        pos = self._oidl + (pos - self.base_num) * 20
+        return binascii.hexlify(self._map[pos:pos + 20])
+
+    def data(self, pos):
+        """ Returns tuple (tree, parents, generation, date) """
+        pos = self._cdat + (pos - self.base_num) * CDAT_SIZE
+        tree = binascii.hexlify(self._map[pos:pos + 20])
+        p1, p2, gen, date = struct.unpack('>IIII', self._map[pos + 20:pos + CDAT_SIZE])
+
+        date |= (gen & 0x3) << 32
+        gen >>= 2
+
+        parents = []
+        if p1 != PARENT_NONE:
+            parents.append(p1)
+
+        if p2 & PARENT_EXTRA_EDGES and p2 != PARENT_NONE:
+            i = self._edge + (p2 & 0x7fffffff) * 4
+            while True:
+                e = struct.unpack('>I', self._map[i:i + 4])[0]
+                parents.append(e & 0x7fffffff)
+                if e & PARENT_LAST_EDGE:
+                    break
+                i += 4
+        elif p2 != PARENT_NONE:
+            parents.append(p2)
+
+        return (tree, parents, gen, date, )
+
+    def close(self):
+        self._map.close()
+
+
+class CommitGraph(object):
+    """ Reader of commit-graph of repository (objects/info/commit-graph or
+        chain of split graphs in objects/info/commit-graphs/). Gives
+        parents, commit dates and generation numbers of commits without
+        reading commit objects.
+
+        Commits are identified by their position in graph, use position()
+        and id() for conversion from/to hexadecimal id.
+    """
+
+    def __init__(self, dir):
+        self._files = []
+
+        info = os.path.join(dir, 'objects', 'info')
+        single = os.path.join(info, 'commit-graph')
+        chain = os.path.join(info, 'commit-graphs', 'commit-graph-chain')
+
+        if os.path.isfile(single):
+            self._files.append(CommitGraphFile(single))
+
+        elif os.path.isfile(chain):
+            f = open(chain, 'r')
+            hashes = [l.strip() for l in f if len(l.strip()) > 0]
+            f.close()
+
+            base_num = 0
+            for h in hashes:
+                path = os.path.join(info, 'commit-graphs', 'graph-' + h + '.graph')
+                g = CommitGraphFile(path, base_num)
+                self._files.append(g)
+                base_num += g.num
+
+    def __len__(self):
+        return sum([g.num for g in self._files])
+
+    def _file(self, pos):
+        for g in self._files:
+            if pos < g.base_num + g.num:
+                return g
+        raise IndexError(pos)
+
+    def position(self, id):
+        """ Returns position of commit with hexadecimal id or None if the
+            commit is not in graph.
+        """
+        sha = binascii.unhexlify(id)
+        for g in self._files:
+            pos = g.position(sha)
+            if pos is not None:
+                return pos
+        return None
+
+    def id(self, pos):
+        return self._file(pos).id(pos)
+
+    def data(self, pos):
+        """ Returns tuple (tree, parents, generation, date) """
+        return self._file(pos).data(pos)
+
+    def tree(self, pos):
+        return self._file(pos).data(pos)[0]
+
+    def parents(self, pos):
+        """ Returns list of positions of parents """
+        return self._file(pos).data(pos)[1]
+
+    def generation(self, pos):
+        return self._file(pos).data(pos)[2]
+
+    def date(self, pos):
+        """ Returns commit date (epoch) """
+        return self._file(pos).data(pos)[3]
+
+    def close(self):
+        for g in self._files:
+            g.close()
+        self._files = []
+
+
+def _fingerprint(dir):
+    info = os.path.join(dir, 'objects', 'info')
+    fp = []
+    for path in [os.path.join(info, 'commit-graph'),
+                 os.path.join(info, 'commit-graphs', 'commit-graph-chain')]:
+        try:
+            st = os.stat(path)
+            fp.append((st.st_ino, st.st_mtime, st.st_size))
+        except OSError:
+            fp.append(None)
+    return tuple(fp)
+
+# Commit graphs opened by the current process, keyed by repository
+# directory: dir -> (fingerprint, graph)
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+def commitGraph(dir):
+    """ Returns CommitGraph of repository or None if repository has no
+        (usable) commit-graph. Graph is reopened when it is rewritten by
+        git.
+    """
+    global _graphs
+
+    fp = _fingerprint(dir)
+
+    _graphs_lock.acquire()
+    try:
+        cached = _graphs.get(dir)
+        if cached and cached[0] == fp:
+            return cached[1]
+
+        graph = None
+        if fp != (None, None):
+            try:
+                graph = CommitGraph(dir)
+                if len(graph) == 0:
+                    graph = None
+            except (IOError, OSError, ValueError, struct.error):
+                graph = None
+
+        # old graph is not closed because it can be still used by other
+        # thread, mmaps are released when it is garbage collected
+        _graphs[dir] = (fp, graph)
+        return graph
+    finally:
+        _graphs_lock.release()
@@ -21,6 +21,8 @@
 ##
 
 from mod_python import apache, util
+import os
+import email.utils
 
 class ModPythonOutput(object):
     """ Class able to produce output using mod_python's request object """
@@ -35,6 +37,14 @@ class ModPythonOutput(object):
         s = s.replace('\n', '<br />')
         return s
 
+    def _escAttr(self, s):
+        """ Escapes s so it can be used as value of HTML attribute """
+        s = s.replace('&', '&amp;')
+        s = s.replace('<', '&lt;')
+        s = s.replace('>', '&gt;')
+        s = s.replace('"', '&quot;')
+        return s
+
     def write(self, s):
         self._req.write(s)
 
@@ -44,6 +54,72 @@ class ModPythonOutput(object):
     def setFilename(self, filename):
         self._req.headers_out['Content-disposition'] = ' attachment; filename="{0}"'.format(filename)
 
+    def parseRange(self, size, etag = None, last_modified = None):
+        """ Parses Range header of request for entity of size bytes.
+            Returns tuple (first byte, last byte), None if whole entity
+            should be sent (no Range header, or one which is not supported)
+            or False if the range can't be satisfied.
+
+            Only single byte range is supported, requests for multiple
+            ranges are answered with the whole entity. If-Range is compared
+            with etag or last_modified (epoch) of the entity.
+        """
+        header = self._req.headers_in.get('Range')
+        if not header:
+            return None
+
+        if_range = self._req.headers_in.get('If-Range')
+        if if_range:
+            if_range = if_range.strip()
+            if if_range[:1] == '"' or if_range[:2] == 'W/':
+                # weak tags never match
+                if if_range != etag:
+                    return None
+            else:
+                date = email.utils.parsedate_tz(if_range)
+                if last_modified is None or not date \
+                   or email.utils.mktime_tz(date) != last_modified:
+                    return None
+
+        header = header.strip()
+        if header[:6] != 'bytes=' or ',' in header:
+            return None
+
+        first, sep, last = header[6:].strip().partition('-')
+        if not sep:
+            return None
+
+        try:
+            if len(first) == 0:
+                # suffix range: the last bytes of entity
+                length = int(last)
+                if length <= 0 or size <= 0:
+                    return False
+                return (max(size - length, 0), size - 1, )
+
+            first = int(first)
+            if len(last) == 0:
+                last = size - 1
+            else:
+                last = min(int(last), size - 1)
+        except ValueError:
+            return None
+
+        if first < 0 or last < first:
+            if first >= 0 and first >= size:
+                return False
+            return None
+        if first >= size:
+            return False
+        return (first, last, )
+
+    def sendFile(self, path):
+        """ Sends content of file directly by server (without reading it
+            into python)
+        """
+        self._req.set_content_length(os.path.getsize(path))
+        self._req.sendfile(path)
+
     def run(self):
         self.write("This method should be overloaded")
         return apache.OK
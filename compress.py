@@ -0,0 +1,123 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import zlib
+import bz2
+import struct
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
+
+lzma = None
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        pass
+
+
+def gzipBlock(data):
+    """ Compresses data as one complete gzip member """
+    c = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    out  = '\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+    out += c.compress(data) + c.flush()
+    out += struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+    return out
+
+def bzip2Block(data):
+    return bz2.compress(data, 9)
+
+def xzBlock(data):
+    return lzma.compress(data)
+
+compressors = { 'gzip'  : gzipBlock,
+                'bzip2' : bzip2Block }
+if lzma:
+    compressors['xz'] = xzBlock
+
+
+def supported(compress):
+    """ Returns True if compress (name of compression program) can be
+        done in-process by parallelIter()
+    """
+    return compress in compressors
+
+
+# Thread pools shared by all requests handled by the current process,
+# keyed by number of threads
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _getPool(threads):
+    _pools_lock.acquire()
+    try:
+        if threads not in _pools:
+            _pools[threads] = ThreadPool(threads)
+        return _pools[threads]
+    finally:
+        _pools_lock.release()
+
+def parallelIter(chunks, compress, threads, block_size = 1024 * 1024):
+    """ Compresses data yielded by chunks generator and yields compressed
+        data.
+
+        Input is split into blocks of block_size bytes which are compressed
+        independently on a pool of threads (zlib, bz2 and lzma release
+        GIL while compressing). Each block forms one complete gzip member
+        (bzip2 or xz stream) and concatenation of such members is valid
+        compressed file.
+    """
+    fn = compressors[compress]
+    pool = _getPool(threads)
+
+    # number of blocks compressed at once, it bounds memory used
+    max_pending = threads * 2
+    pending = collections.deque()
+
+    try:
+        block = []
+        block_len = 0
+        for chunk in chunks:
+            block.append(chunk)
+            block_len += len(chunk)
+            if block_len < block_size:
+                continue
+
+            data = ''.join(block)
+            while len(data) >= block_size:
+                pending.append(pool.apply_async(fn, (data[:block_size], )))
+                data = data[block_size:]
+            block = [data]
+            block_len = len(data)
+
+            while len(pending) >= max_pending:
+                yield pending.popleft().get()
+
+        if block_len > 0 or len(pending) == 0:
+            pending.append(pool.apply_async(fn, (''.join(block), )))
+
+        while len(pending) > 0:
+            yield pending.popleft().get()
+    finally:
+        chunks.close()
@@ -0,0 +1,145 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import re
+import bisect
+
+import cache
+
+
+# Parsed indexes keyed by tree id, trees are immutable so the cache is
+# shared by all repositories
+index_cache = cache.LRUCache(4)
+
+
+class FileIndex(object):
+    """ Index of all paths in one tree.
+
+        It is built from output of git ls-tree -r -t -l -z --full-tree
+        (entries 'mode type id size<TAB>path' separated by NUL) and holds
+        entries sorted by path, so files matching a search query are found
+        without asking git. The find action builds the index, the tree view
+        lists a directory from it only if it is already cached.
+    """
+
+    def __init__(self, data):
+        entries = []
+        for line in data.split('\x00'):
+            if len(line) == 0:
+                continue
+            info, path = line.split('\t', 1)
+            entries.append((path, info))
+        entries.sort()
+
+        self._paths = [e[0] for e in entries]
+        self._infos = [e[1] for e in entries]
+
+        # all paths in one lower-case string (one path per line) searched by
+        # one regular expression, offsets of lines map matches to entries
+        self._lower = '\n'.join([p.replace('\n', ' ') for p in self._paths]).lower()
+        self._offsets = []
+        offset = 0
+        for p in self._paths:
+            self._offsets.append(offset)
+            offset += len(p) + 1
+
+    def __len__(self):
+        return len(self._paths)
+
+    def lookup(self, path):
+        """ Returns entry (ls-tree line without path) of path or None """
+        i = bisect.bisect_left(self._paths, path)
+        if i < len(self._paths) and self._paths[i] == path:
+            return self._infos[i]
+        return None
+
+    def children(self, dir):
+        """ Returns list of ls-tree lines ('mode type id size<TAB>name') of
+            entries in directory dir (empty string is root) in the same
+            order as git ls-tree lists them.
+        """
+        prefix = ''
+        if len(dir) > 0:
+            prefix = dir + '/'
+
+        out = []
+        i = bisect.bisect_left(self._paths, prefix)
+        while i < len(self._paths) and self._paths[i].startswith(prefix):
+            name = self._paths[i][len(prefix):]
+            if '/' in name:
+                # skip the rest of subdirectory ('0' follows '/')
+                sub = prefix + name.split('/', 1)[0] + '0'
+                i = bisect.bisect_left(self._paths, sub, i)
+                continue
+
+            # git sorts names of trees as if they ended with slash
+            info = self._infos[i]
+            key = name
+            if info.split(' ', 2)[1] == 'tree':
+                key += '/'
+            out.append((key, info + '\t' + name))
+            i += 1
+
+        out.sort()
+        return [line for key, line in out]
+
+    def find(self, query, limit = 100):
+        """ Returns list of (path, entry) of at most limit blobs whose path
+            contains all characters of query in the same order (case
+            insensitive). The best matches (whole filename, prefix of
+            filename, substring of filename, substring of path) come
+            first.
+        """
+        query = query.lower().replace('\n', ' ')
+        if len(query) == 0:
+            return []
+
+        # each character is matched by its first occurrence after the
+        # previous one, so the expression never backtracks
+        pattern = ''
+        for c in query:
+            c = re.escape(c)
+            pattern += '[^' + c + '\n]*' + c
+        pattern = '^' + pattern + '[^\n]*$'
+
+        found = []
+        for m in re.finditer(pattern, self._lower, re.MULTILINE):
+            i = bisect.bisect_right(self._offsets, m.start()) - 1
+            if self._infos[i].split(' ', 2)[1] != 'blob':
+                continue
+
+            path = m.group(0)
+            name = path.rsplit('/', 1)[-1]
+            if name == query:
+                score = 0
+            elif name.startswith(query):
+                score = 1
+            elif query in name:
+                score = 2
+            elif query in path:
+                score = 3
+            else:
+                score = 4
+            found.append((score, len(path), self._paths[i], i))
+
+        found.sort()
+        return [(path, self._infos[i]) for score, l, path, i in found[:limit]]
@@ -21,10 +21,21 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 ##
 
+import os
 import re
 import datetime
-from subprocess import Popen, PIPE, STDOUT
+from subprocess import Popen, PIPE
 import stat
+import threading
+import heapq
+import copy
+import itertools
+import collections
+
+import cache
+import compress as compressmod
+import commit_graph
+import file_index
 
 basic_patterns = {
     'id' : r'[0-9a-fA-F]{40}',
@@ -33,6 +44,7 @@ basic_patterns = {
 }
 
 patterns = {
+    'id'        : re.compile(r'^{id}$'.format(**basic_patterns)),
     'person'    : re.compile(r'[^ ]* (.*) ({epoch}) ({tz})$'.format(**basic_patterns)),
     'person2'   : re.compile(r'(.*) <(.*)>'),
 	'diff-tree' : re.compile(r'^:([0-7]{6}) ([0-7]{6}) ([0-9a-fA-F]{40}) ([0-9a-fA-F]{40}) (.)([0-9]{0,3})\t(.*)$'),
@@ -40,6 +52,273 @@ patterns = {
 }
 
 
+# Parsed commits (GitCommit objects) keyed by (repository directory, id),
+# shared by all requests handled by the current process. Cached objects are
+# never modified, refs are attached to their copies (see commitsSetRefs()).
+commit_cache = cache.LRUCache(20000)
+
+# Ids of subtrees keyed by (id of tree, path), both immutable
+tree_path_cache = cache.LRUCache(20000)
+
+# Sizes of blobs keyed by id
+blob_size_cache = cache.LRUCache(100000)
+
+
+class ProcessGroup(object):
+    """ Git processes started by one job, so they can be killed from other
+        thread when the job runs out of time. A thread records processes
+        it starts into group set by trackProcesses().
+    """
+
+    def __init__(self):
+        self.killed = False
+        self._procs = []
+        self._lock = threading.Lock()
+
+    def add(self, pipe):
+        self._lock.acquire()
+        try:
+            if not self.killed:
+                self._procs.append(pipe)
+                return
+        finally:
+            self._lock.release()
+        self._terminate(pipe)
+
+    def kill(self):
+        """ Terminates all running processes of the group and any process
+            added later.
+        """
+        self._lock.acquire()
+        try:
+            self.killed = True
+            procs = self._procs
+            self._procs = []
+        finally:
+            self._lock.release()
+
+        for pipe in procs:
+            self._terminate(pipe)
+
+    def _terminate(self, pipe):
+        if pipe.poll() is None:
+            try:
+                pipe.terminate()
+            except OSError:
+                pass
+
+_tracking = threading.local()
+
+def trackProcesses(group):
+    """ Sets ProcessGroup which records git processes started by the
+        current thread (None stops recording).
+    """
+    _tracking.group = group
+
+
+# Results of Git.refs() keyed by repository directory:
+# dir -> [fingerprint, (tags, heads, remotes), index] where index is
+# built by Git.refsIndex() on first use
+refs_cache = {}
+
+def refsFingerprint(dir):
+    """ Returns value which changes whenever any ref of repository in dir
+        changes. It is composed of inode, mtime and size of HEAD,
+        packed-refs and of all directories and files under refs/.
+    """
+    paths = [os.path.join(dir, 'HEAD'), os.path.join(dir, 'packed-refs')]
+    for root, dirs, files in os.walk(os.path.join(dir, 'refs')):
+        paths.append(root)
+        paths.extend([os.path.join(root, f) for f in files])
+
+    fp = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            fp.append((path, st.st_ino, st.st_mtime, st.st_size, ))
+        except OSError:
+            fp.append((path, None, ))
+    return tuple(fp)
+
+
+class GitCatFile(object):
+    """ Long-lived git-cat-file(1) process running in --batch (or
+        --batch-check) mode.
+
+        Object names are written to stdin of the process one per line and
+        the answers are read back from its stdout, so any number of objects
+        can be read without forking new git process for each of them.
+        If the process dies it is transparently restarted. Its stderr is
+        discarded so git never blocks on writing error messages nobody
+        reads.
+    """
+
+    def __init__(self, dir, gitbin = '/usr/bin/git', check = False):
+        self._dir = dir
+        self._gitbin = gitbin
+        self._check = check
+        self._pipe = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        comm = [self._gitbin, '--git-dir={0}'.format(self._dir), 'cat-file']
+        if self._check:
+            comm.append('--batch-check')
+        else:
+            comm.append('--batch')
+
+        devnull = open(os.devnull, 'wb')
+        try:
+            self._pipe = Popen(comm, stdin = PIPE, stdout = PIPE,
+                               stderr = devnull, bufsize = -1)
+        finally:
+            devnull.close()
+
+    def _stop(self):
+        if not self._pipe:
+            return
+
+        try:
+            self._pipe.stdin.close()
+            self._pipe.stdout.close()
+            self._pipe.wait()
+        except (IOError, OSError):
+            pass
+        self._pipe = None
+
+    def _query(self, obj):
+        return self._queryMany([obj])[0]
+
+    def _queryMany(self, objs):
+        if not self._pipe or self._pipe.poll() is not None:
+            self._stop()
+            self._start()
+
+        # names are written in batches small enough that answers of
+        # --batch-check fit into pipe buffer and git never blocks on
+        # writing while we are still writing
+        out = []
+        for i in range(0, len(objs), 256):
+            batch = objs[i:i + 256]
+            self._pipe.stdin.write(''.join([obj + '\n' for obj in batch]))
+            self._pipe.stdin.flush()
+
+            for obj in batch:
+                out.append(self._read())
+        return out
+
+    def _read(self):
+        header = self._pipe.stdout.readline()
+        if not header:
+            raise IOError('git cat-file terminated')
+
+        h = header.split()
+        if len(h) != 3:
+            # <obj> missing or <obj> ambiguous
+            return None
+
+        id, type, size = h[0], h[1], int(h[2])
+        data = None
+        if not self._check:
+            data = self._pipe.stdout.read(size)
+            self._pipe.stdout.read(1) # trailing LF
+            if len(data) != size:
+                raise IOError('git cat-file terminated')
+
+        return (id, type, size, data, )
+
+    def query(self, obj):
+        """ Returns tuple (id, type, size, data) describing object obj
+            or None if the object does not exist. data is None in
+            --batch-check mode.
+        """
+
+        # name of the object can't contain newline because it's used as
+        # delimiter in communication with git
+        if not obj or '\n' in obj:
+            return None
+
+        self._lock.acquire()
+        try:
+            try:
+                return self._query(obj)
+            except (IOError, OSError):
+                # try it once more with newly started process
+                self._stop()
+                return self._query(obj)
+        finally:
+            self._lock.release()
+
+    def queryMany(self, objs):
+        """ Same as query() but for list of objects, returns list of
+            answers. All objects are sent to git at once which saves one
+            round trip per object.
+        """
+        objs = list(objs)
+        out = [None] * len(objs)
+
+        # only valid names are sent to git
+        valid = [i for i, obj in enumerate(objs) if obj and '\n' not in obj]
+        names = [objs[i] for i in valid]
+        if len(names) == 0:
+            return out
+
+        self._lock.acquire()
+        try:
+            try:
+                answers = self._queryMany(names)
+            except (IOError, OSError):
+                self._stop()
+                answers = self._queryMany(names)
+        finally:
+            self._lock.release()
+
+        for i, answer in zip(valid, answers):
+            out[i] = answer
+        return out
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._stop()
+        finally:
+            self._lock.release()
+
+# Running git-cat-file processes shared between all GitComm objects of the
+# current process, keyed by (gitbin, dir, check). At most
+# cat_files_max_processes processes are kept, the least recently used one is
+# terminated when the limit is exceeded.
+cat_files_max_processes = 32
+_cat_files = collections.OrderedDict()
+_cat_files_lock = threading.Lock()
+
+def catFileProcess(dir, gitbin = '/usr/bin/git', check = False):
+    """ Returns GitCatFile process for repository dir. Processes are
+        created on first use and reused by all subsequent requests handled
+        by the current process.
+    """
+    key = (gitbin, dir, check)
+    evicted = []
+    _cat_files_lock.acquire()
+    try:
+        proc = _cat_files.pop(key, None)
+        if proc is None:
+            proc = GitCatFile(dir, gitbin, check)
+        _cat_files[key] = proc
+
+        while len(_cat_files) > cat_files_max_processes:
+            evicted.append(_cat_files.popitem(last = False)[1])
+    finally:
+        _cat_files_lock.release()
+
+    # closing waits for query running in other thread, so it is done
+    # without holding the lock
+    for p in evicted:
+        p.close()
+
+    return proc
+
+
 class GitComm(object):
     """ This class is 1:1 interface to git commands. Meaning of most
         parameters of most methods should be obvious after reading man pages
@@ -65,7 +344,16 @@ class GitComm(object):
         comm = [self._gitbin, '--git-dir={0}'.format(self._dir)]
         comm.extend(args)
 
-        pipe = Popen(comm, stdout = PIPE, stderr = STDOUT)
+        # error messages would be mixed into output
+        devnull = open(os.devnull, 'wb')
+        try:
+            pipe = Popen(comm, stdout = PIPE, stderr = devnull)
+        finally:
+            devnull.close()
+
+        group = getattr(_tracking, 'group', None)
+        if group is not None:
+            group.add(pipe)
         return pipe
 
     def _git(self, args):
@@ -75,12 +363,53 @@ class GitComm(object):
 
         return out
 
+    def _gitIter(self, args, bufsize = 65536, check = False):
+        """ Yields output of git command in chunks as soon as it is
+            produced. If the generator is closed before whole output is
+            read, git process is terminated.
+
+            If check is True, IOError is raised after the whole output is
+            read if git didn't exit successfully.
+        """
+        pipe = self._gitPipe(args)
+        done = False
+        try:
+            while True:
+                s = os.read(pipe.stdout.fileno(), bufsize)
+                if not s:
+                    break
+                yield s
+            done = True
+        finally:
+            pipe.stdout.close()
+            if not done and pipe.poll() is None:
+                try:
+                    pipe.terminate()
+                except OSError:
+                    pass
+            pipe.wait()
+
+        if check and pipe.returncode != 0:
+            raise IOError('git {0} exited with status {1}'.format(args[0],
+                                                                  pipe.returncode))
+
     def revList(self, obj = 'HEAD', parents = False, header = False,
-                      max_count = -1, all = False):
+                      max_count = -1, all = False, skip = 0):
         """ git-rev-list(1)
                 Lists commit objects in reverse chronological order.
         """
+        return self._git(self._revListArgs(obj, parents, header, max_count,
+                                           all, skip))
+
+    def revListIter(self, obj = 'HEAD', parents = False, header = False,
+                          max_count = -1, all = False, skip = 0):
+        """ Same as revList() but output is yielded in chunks as git
+            produces it.
+        """
+        return self._gitIter(self._revListArgs(obj, parents, header, max_count,
+                                               all, skip))
 
+    def _revListArgs(self, obj, parents, header, max_count, all, skip):
         comm = ['rev-list']
 
         if parents:
@@ -89,13 +418,15 @@ class GitComm(object):
             comm.append('--header')
         if max_count > 0:
             comm.append('--max-count={0}'.format(max_count))
+        if skip > 0:
+            comm.append('--skip={0}'.format(skip))
 
         if not all and obj:
             comm.append(obj)
         if all:
             comm.append('--all')
 
-        return self._git(comm)
+        return comm
 
     def forEachRef(self, format = None, sort = None, pattern = None):
         """ git-for-each-ref(1)
@@ -139,6 +470,45 @@ class GitComm(object):
         comm.append(obj)
         return self._git(comm)
 
+    def catFileIter(self, obj = 'HEAD', type = 'blob', bufsize = 65536,
+                          skip = 0):
+        """ Yields content of object obj of type in chunks as git
+            produces it (see catFile()), first skip bytes are left out.
+        """
+        chunks = self._gitIter(['cat-file', type, obj], bufsize)
+        if skip > 0:
+            chunks = self._skipIter(chunks, skip)
+        return chunks
+
+    def _skipIter(self, chunks, skip):
+        try:
+            for chunk in chunks:
+                if skip >= len(chunk):
+                    skip -= len(chunk)
+                    continue
+                yield chunk[skip:]
+                skip = 0
+        finally:
+            chunks.close()
+
+    def catFileBatch(self, obj = 'HEAD'):
+        """ git-cat-file(1) --batch
+                Returns (id, type, size, data) of object or None if the
+                object does not exist. Persistent git process is used.
+        """
+        return catFileProcess(self._dir, self._gitbin).query(obj)
+
+    def catFileBatchCheck(self, obj = 'HEAD'):
+        """ git-cat-file(1) --batch-check
+                Returns (id, type, size, None) of object or None if the
+                object does not exist. Persistent git process is used.
+        """
+        return catFileProcess(self._dir, self._gitbin, check = True).query(obj)
+
+    def catFileBatchCheckMany(self, objs):
+        """ Same as catFileBatchCheck() but for list of objects """
+        return catFileProcess(self._dir, self._gitbin, check = True).queryMany(objs)
+
     def diffTree(self, obj = 'HEAD', parent = None, patch = False):
         comm = ['diff-tree']
 
@@ -160,11 +530,13 @@ class GitComm(object):
         return self._git(comm)
 
     def lsTree(self, obj = 'HEAD', recursive = False, long = False,
-                     full_tree = False, zeroterm = True):
+                     full_tree = False, zeroterm = True, trees = False):
         comm = ['ls-tree']
 
         if recursive:
             comm.append('-r')
+        if trees:
+            comm.append('-t')
         if long:
             comm.append('--long')
         if full_tree:
@@ -192,19 +564,58 @@ class GitComm(object):
         return self._git(comm)
 
     def archive(self, id, format = 'tar', prefix = 'a/', compress = None):
+        return ''.join(self.archiveIter(id, format, prefix, compress))
+
+    def archiveIter(self, id, format = 'tar', prefix = 'a/', compress = None,
+                          bufsize = 65536):
+        """ Same as archive() but output is yielded in chunks of at most
+            bufsize bytes as it is produced. IOError is raised at the end
+            of output if git or compressor failed, so incomplete archive
+            isn't mistaken for a complete one.
+        """
         comm = ['archive']
         comm.append('--format={0}'.format(format))
         comm.append('--prefix={0}'.format(prefix))
         comm.append(id)
 
         if compress:
-            pipe = self._gitPipe(comm)
-            compressor = Popen([compress], stdout = PIPE, stderr = STDOUT, stdin = pipe.stdout)
-            s = compressor.stdout.read()
-            compressor.stdout.close()
-            return s
+            return self._compressIter(comm, compress, bufsize)
         else:
-            return self._git(comm)
+            return self._gitIter(comm, bufsize, check = True)
+
+    def _compressIter(self, args, compress, bufsize):
+        pipe = self._gitPipe(args)
+        devnull = open(os.devnull, 'wb')
+        try:
+            compressor = Popen([compress], stdout = PIPE, stderr = devnull,
+                               stdin = pipe.stdout)
+        finally:
+            devnull.close()
+        # only compressor reads output of git
+        pipe.stdout.close()
+
+        done = False
+        try:
+            while True:
+                s = os.read(compressor.stdout.fileno(), bufsize)
+                if not s:
+                    break
+                yield s
+            done = True
+        finally:
+            compressor.stdout.close()
+            for p in [compressor, pipe]:
+                if not done and p.poll() is None:
+                    try:
+                        p.terminate()
+                    except OSError:
+                        pass
+                p.wait()
+
+        for name, p in [('git ' + args[0], pipe), (compress, compressor)]:
+            if p.returncode != 0:
+                raise IOError('{0} exited with status {1}'.format(name,
+                                                                  p.returncode))
 
 class GitDate(object):
     def __init__(self, epoch, tz):
@@ -236,6 +647,7 @@ class GitDate(object):
 
     def _parseEpochTz(self, epoch, tz):
         epoch = int(epoch)
+        self.epoch = epoch
 
         # prepare gmt epoch
         h = int(tz[1:3])
@@ -344,14 +756,17 @@ class GitTag(GitObj):
         self.tagger = tagger
 
 class GitHead(GitObj):
-    def __init__(self, git, id, name = ''):
+    def __init__(self, git, id, name = '', subject = '', author = None):
         super(GitHead, self).__init__(git, id)
 
         self.name  = name
 
+        # first line of message and author of commit the head points to
+        self.subject = subject
+        self.author  = author
+
     def commit(self):
-        c = self.git.revList(self.id, max_count = 1)
-        return c[0]
+        return self.git.commit(self.id)
 
 class GitDiffTree(GitObj):
     def __init__(self, git, from_mode, to_mode, from_id, to_id, status,
@@ -400,35 +815,249 @@ class GitBlob(GitObj):
 
 
 class Git(object):
-    def __init__(self, dir, gitbin = '/usr/bin/git'):
+    def __init__(self, dir, gitbin = '/usr/bin/git', comm = None):
+        """ comm is object with GitComm interface used for communication
+            with git repository, GitComm is used by default.
+        """
         global patterns
 
-        self._git = GitComm(dir, gitbin)
+        if comm is None:
+            comm = GitComm(dir, gitbin)
+        self._git = comm
+        self._dir = dir
         self._patterns = patterns
 
-    def revList(self, obj = 'HEAD', max_count = -1, all = False):
-        # get raw data
-        res = self._git.revList(obj, parents = True, header = True,
-                                     max_count = max_count, all = all)
+    def revList(self, obj = 'HEAD', max_count = -1, all = False, skip = 0):
+        return list(self.revListIter(obj, max_count = max_count, all = all,
+                                          skip = skip))
+
+    def revListIter(self, obj = 'HEAD', max_count = -1, all = False, skip = 0):
+        """ Yields GitCommit objects one by one in the same order as
+            git-rev-list(1) lists them. First skip commits are omitted.
+
+            History of single revision is walked in-process (see _walk()),
+            so commits already in commit_cache cost no git call and skipped
+            commits found in commit-graph are not read at all. Otherwise
+            (or if there is no commit-graph and commits are to be skipped)
+            output of git-rev-list --skip is parsed as it is produced;
+            closing the generator stops git.
+        """
+        skip = max(skip, 0)
+
+        if not all and obj:
+            ids = self._walkRevList(obj, max_count, skip)
+            if ids is not None:
+                for id in ids:
+                    yield self.commit(id)
+                return
+
+        chunks = self._git.revListIter(obj, parents = True, header = True,
+                                            max_count = max_count, all = all,
+                                            skip = skip)
+        try:
+            # output is split into hunks (each corresponding with one
+            # commit), the last hunk can be incomplete
+            rest = ''
+            for chunk in chunks:
+                hunks = (rest + chunk).split('\x00')
+                rest = hunks.pop()
+
+                for commit_str in hunks:
+                    if len(commit_str) <= 1:
+                        continue
+                    yield self._cacheCommit(self._parseCommit(commit_str))
+
+            if len(rest) > 1:
+                yield self._cacheCommit(self._parseCommit(rest))
+        finally:
+            chunks.close()
+
+    def _cacheCommit(self, commit):
+        commit_cache.put((self._dir, commit.id), commit)
+        return commit
+
+    def _walkRevList(self, obj, max_count, skip):
+        """ Returns generator of ids of commits (same as git-rev-list would
+            list) computed by walking history from obj in-process or None
+            if obj can't be resolved or skipped commits would have to be
+            read one by one (git-rev-list does it faster).
+        """
+        graph = commit_graph.commitGraph(self._dir)
+        if graph is None and skip > 0:
+            return None
+
+        start = self.resolve(obj, 'commit')
+        if not start:
+            return None
+
+        stop = None
+        if max_count > 0:
+            stop = skip + max_count
+
+        return itertools.islice(self._walk(graph, [start]), skip, stop)
+
+    def revListFrom(self, starts, max_count, listed = []):
+        """ Returns tuple (commits, next, listed) where commits is list of
+            at most max_count commits reachable from starts (in
+            git-rev-list(1) order) except commits in listed and next and
+            listed are arguments of the call which lists the following
+            commits (next is empty if there is nothing more). Cost depends
+            only on max_count, not on how deep in history starts are.
+
+            The next call doesn't know all commits listed before, so it
+            relies on commits being listed from the newest to the oldest:
+            a commit listed before can be reached again only if it has the
+            same date as the last listed commit, and only such commits are
+            passed in listed. If a commit is newer than its child (clock
+            skew, rebase), that doesn't hold and None is returned; the
+            caller has to use revList() with skip instead.
+        """
+        ids = []
+        for id in starts:
+            id = self.resolve(id, 'commit')
+            if id:
+                ids.append(id)
 
-        # split into hunks (each corresponding with one commit)
-        commits_str = res.split('\x00')
+        graph = commit_graph.commitGraph(self._dir)
+        queue = []
+        walk = self._walk(graph, ids, queue, seen = set(listed))
 
-        # create GitCommit object from each string hunk
+        dates = []
         commits = []
-        for commit_str in commits_str:
-            if len(commit_str) > 1:
-                commits.append(self._parseCommit(commit_str))
+        for id in itertools.islice(walk, max_count):
+            date = self._commitLinks(graph, id)[0]
+            if len(dates) > 0 and date > dates[-1]:
+                walk.close()
+                return None
+            dates.append(date)
+            commits.append(self.commit(id))
+        walk.close()
+
+        # commits remaining in the queue must not be newer than the last
+        # listed one either
+        if len(dates) > 0 and len(queue) > 0 and -min(queue)[0] > dates[-1]:
+            return None
+
+        next = [item[2] for item in sorted(queue)]
 
-        return commits
+        # commits of the last date (the group can span more pages)
+        last = []
+        if len(dates) > 0:
+            for id in listed:
+                links = self._commitLinks(graph, id)
+                if links and links[0] == dates[-1]:
+                    last.append(id)
+            last += [c.id for c, date in zip(commits, dates) if date == dates[-1]]
+
+        return (commits, next, last, )
+
+    def _walk(self, graph, starts, queue = None, seen = None):
+        """ Yields ids of commits reachable from starts in the same order as
+            git-rev-list(1) does (by commit date, newest first).
+
+            Parents and dates are taken from commit-graph (if graph is
+            not None), then from commit_cache and only the rest of commits
+            is read from repository.
+
+            If queue (empty list) is given, it is used as queue of the walk,
+            i.e., after a commit is yielded it contains commits which are
+            to be yielded next. Commits in seen (set) are neither yielded
+            nor walked through.
+        """
+        if queue is None:
+            queue = []
+        if seen is None:
+            seen = set()
+        seq   = 0
+
+        def push(id):
+            links = self._commitLinks(graph, id)
+            if links:
+                heapq.heappush(queue, (-links[0], seq, id, links[1]))
+
+        for id in starts:
+            if id not in seen:
+                seen.add(id)
+                push(id)
+                seq += 1
+
+        while queue:
+            date, s, id, parents = heapq.heappop(queue)
+
+            for p in parents:
+                if p not in seen:
+                    seen.add(p)
+                    push(p)
+                    seq += 1
+
+            yield id
+
+    def _commitLinks(self, graph, id):
+        """ Returns (commit date, list of parents) of commit or None if
+            there is no such commit.
+        """
+        if graph:
+            pos = graph.position(id)
+            if pos is not None:
+                tree, parents, gen, date = graph.data(pos)
+                return (date, [graph.id(p) for p in parents], )
+
+        commit = self.commit(id)
+        if not commit:
+            return None
+        return (commit.committer.date.epoch, commit.parents, )
 
     def commit(self, id = 'HEAD'):
-        c = self.revList(id, max_count = 1)
-        if len(c) == 0:
+        if not self._patterns['id'].match(id):
+            id = self.resolve(id, 'commit')
+            if not id:
+                return None
+
+        commit = commit_cache.get((self._dir, id))
+        if commit:
+            return commit
+
+        obj = self._git.catFileBatch(id + '^{commit}')
+        if not obj:
             return None
-        return c[0]
+
+        return self._cacheCommit(self._parseCommitObj(obj[0], obj[3]))
+
+    def resolve(self, id, type = None):
+        """ Returns full id of object id or None if there is no such
+            object. If type is specified, object is peeled to that type
+            (e.g. tag to commit, commit to tree).
+        """
+        # in <rev>:<path> everything after colon is path, so object can
+        # only be checked for its type
+        peel = type and ':' not in id
+        if peel:
+            id += '^{' + type + '}'
+
+        obj = self._git.catFileBatchCheck(id)
+        if not obj:
+            return None
+        if type and not peel and obj[1] != type:
+            return None
+        return obj[0]
 
     def refs(self):
+        """ Returns tuple (tags, heads, remotes). Result is cached per
+            repository and recomputed only if refs of the repository change
+            (see refsFingerprint()).
+        """
+        global refs_cache
+
+        fp = refsFingerprint(self._dir)
+        cached = refs_cache.get(self._dir)
+        if cached and cached[0] == fp:
+            return cached[1]
+
+        refs = self._refs()
+        refs_cache[self._dir] = [fp, refs, None]
+        return refs
+
+    def _refs(self):
         format  = '%(objectname) %(objecttype) %(refname) <%(*objectname)> %(subject)%00%(creator)'
 
         tags    = []
@@ -445,44 +1074,82 @@ class Git(object):
 
 
         # heads, remotes
+        # Author and message of commit are read at once with refs, so
+        # listing of heads doesn't need to read commits one by one.
+        # Each record is terminated by NUL and newline because message
+        # can span more lines.
+        format  = '%(objectname) %(objecttype) %(refname)%00%(author)%00%(contents)%00'
         res = self._git.forEachRef(format = format,
                                    sort = '-committerdate', 
                                    pattern = ['refs/heads', 'refs/remotes'])
-        lines = res.split('\n')
-        for line in lines:
-            d = line.split(' ')
-            if len(d) < 3:
+        records = res.split('\x00\n')
+        for record in records:
+            r = record.split('\x00')
+            d = r[0].split(' ')
+            if len(d) < 3 or len(r) < 3:
                 continue
 
+            author  = self._parsePerson('author ' + r[1])
+            subject = r[2].split('\n', 1)[0]
+
             if d[2][:11] == 'refs/heads/':
                 id = d[0]
                 name = d[2][11:]
-                o = GitHead(self, id, name = name)
+                o = GitHead(self, id, name = name, subject = subject, author = author)
                 heads.append(o)
             elif d[2][:13] == 'refs/remotes/':
                 id = d[0]
                 name = d[2][13:]
-                o = GitHead(self, id, name = name)
+                o = GitHead(self, id, name = name, subject = subject, author = author)
                 remotes.append(o)
 
         return (tags, heads, remotes, )
 
 
-    def commitsSetRefs(self, commits, tags, heads, remotes):
-        for c in commits:
-            for t in tags:
-                if t.objid == c.id:
-                    c.tags.append(t)
+    def refsIndex(self, tags, heads, remotes):
+        """ Returns dictionary mapping id of commit to tuple (tags, heads,
+            remotes) of refs pointing to it. Index of refs returned by
+            refs() is built only once and shared while refs don't change.
+        """
+        cached = refs_cache.get(self._dir)
+        if cached and cached[1][0] is tags and cached[1][1] is heads \
+           and cached[1][2] is remotes:
+            if cached[2] is None:
+                cached[2] = self._refsIndex(tags, heads, remotes)
+            return cached[2]
+
+        return self._refsIndex(tags, heads, remotes)
 
-            for h in heads:
-                if h.id == c.id:
-                    c.heads.append(h)
+    def _refsIndex(self, tags, heads, remotes):
+        index = {}
 
-            for r in remotes:
-                if r.id == c.id:
-                    c.remotes.append(r)
+        for t in tags:
+            index.setdefault(t.objid, ([], [], [], ))[0].append(t)
+        for h in heads:
+            index.setdefault(h.id, ([], [], [], ))[1].append(h)
+        for r in remotes:
+            index.setdefault(r.id, ([], [], [], ))[2].append(r)
 
-        return commits
+        return index
+
+    def commitsSetRefs(self, commits, tags, heads, remotes):
+        """ Returns list of copies of commits with tags, heads and remotes
+            pointing to them. Commits themselves are not modified because
+            they can be shared with other requests through commit_cache.
+        """
+        index = self.refsIndex(tags, heads, remotes)
+        empty = ([], [], [], )
+
+        out = []
+        for c in commits:
+            refs = index.get(c.id, empty)
+            c = copy.copy(c)
+            c.tags    = list(refs[0])
+            c.heads   = list(refs[1])
+            c.remotes = list(refs[2])
+            out.append(c)
+
+        return out
 
 
     def diffTree(self, id, parent, patch = False):
@@ -511,13 +1178,17 @@ class Git(object):
     def formatPatch(self, id, id2):
         return self._git.formatPatch(id, id2)
 
-    def tree(self, id):
-        s = self._git.lsTree(id, long = True, zeroterm = True)
+    def tree(self, id, sizes = True, size_cache = None):
+        """ Returns list of GitTree and GitBlob objects of tree id. Sizes
+            of blobs are filled only if sizes is True, otherwise size of
+            each object is empty string.
 
-        # try to detect older version of git which does not know --long
-        # option and in this case simply omit size
-        if s.startswith('usage'):
-            s = self._git.lsTree(id, zeroterm = True)
+            Sizes are listed by ls-tree --long unless size_cache
+            (persistent SQLiteCache) is given, then they are looked up by
+            blobSizes().
+        """
+        long = sizes and size_cache is None
+        s = self._git.lsTree(id, long = long, zeroterm = True)
 
         objs = []
 
@@ -526,29 +1197,187 @@ class Git(object):
             if len(line) > 0:
                 objs.append(self._parseTree(line))
 
+        if sizes and not long:
+            self._setSizes(objs, size_cache)
+
         return objs
 
+    def _setSizes(self, objs, size_cache):
+        # trees and submodules have no size (as in ls-tree --long)
+        blobs = []
+        for obj in objs:
+            if type(obj) is GitBlob and obj.mode != '160000':
+                blobs.append(obj)
+            else:
+                obj.size = '-'
+
+        sizes = self.blobSizes([obj.id for obj in blobs], size_cache)
+        for obj in blobs:
+            obj.size = str(sizes.get(obj.id, ''))
+
+    def blobSizes(self, ids, size_cache = None):
+        """ Returns dictionary id -> size of blobs ids.
+
+            Sizes are taken from blob_size_cache, then from size_cache
+            (persistent SQLiteCache) if it is given and the rest is asked
+            from git in one batch.
+        """
+        sizes = blob_size_cache.getMany(ids)
+        missing = [id for id in ids if id not in sizes]
+
+        if len(missing) > 0 and size_cache:
+            found = size_cache.getMany(missing)
+            for id, size in found.iteritems():
+                sizes[id] = size
+                blob_size_cache.put(id, size)
+            missing = [id for id in missing if id not in found]
+
+        if len(missing) > 0:
+            new = {}
+            for id, obj in zip(missing, self._git.catFileBatchCheckMany(missing)):
+                if obj:
+                    new[id] = obj[2]
+                    blob_size_cache.put(id, obj[2])
+            sizes.update(new)
+
+            if size_cache and len(new) > 0:
+                size_cache.putMany(new.items())
+
+        return sizes
+
+    def treePath(self, id, path):
+        """ Returns tuple (subtree id, path) where subtree is the deepest
+            tree on path in tree of object id (commit or tree) and path is
+            path of that subtree. If there is no such tree at all, (None,
+            '') is returned.
+        """
+        root = self.resolve(id, 'tree')
+        if not root:
+            return (None, '', )
+
+        spath = filter(lambda x: len(x) > 0, path.split('/'))
+        while len(spath) > 0:
+            path = '/'.join(spath)
+            subtree = self._treePath(root, path)
+            if subtree:
+                return (subtree, path, )
+            spath.pop()
+
+        return (root, '', )
+
+    def _treePath(self, root, path):
+        key = (root, path, )
+        subtree = tree_path_cache.get(key)
+        if subtree:
+            return subtree
+
+        # the name can't be passed to cat-file --batch-check
+        if '\n' in path:
+            return None
+
+        obj = self._git.catFileBatchCheck(root + ':' + path)
+        if not obj or obj[1] != 'tree':
+            return None
+
+        tree_path_cache.put(key, obj[0])
+        return obj[0]
+
+    def fileIndex(self, id, disk_cache = None, build = True):
+        """ Returns FileIndex of all paths in tree of object id (commit or
+            tree) or None if there is no such tree.
+
+            Indexes are kept in memory and, if disk_cache (DiskCache) is
+            given, also on disk keyed by id of tree. If build is False and
+            the index isn't cached, None is returned.
+        """
+        tree = self.resolve(id, 'tree')
+        if not tree:
+            return None
+
+        index = file_index.index_cache.get(tree)
+        if index is not None:
+            return index
+
+        key = 'file-index\x00' + tree
+        data = None
+        if disk_cache:
+            data = disk_cache.read(key)
+
+        if data is None:
+            if not build:
+                return None
+            data = self._git.lsTree(tree, recursive = True, long = True,
+                                    full_tree = True, trees = True)
+            if disk_cache:
+                disk_cache.put(key, data)
+
+        index = file_index.FileIndex(data)
+        file_index.index_cache.put(tree, index)
+        return index
+
+    def treeFromIndex(self, index, path):
+        """ Same as tree(treePath(id, path)[0]) but entries are taken from
+            index (FileIndex of tree id).
+        """
+        spath = filter(lambda x: len(x) > 0, path.split('/'))
+        while len(spath) > 0:
+            info = index.lookup('/'.join(spath))
+            if info and info.split(' ', 2)[1] == 'tree':
+                break
+            spath.pop()
+
+        return [self._parseTree(line) for line in index.children('/'.join(spath))]
+
+    def blobIter(self, id, bufsize = 65536, start = 0):
+        """ Yields content of blob id from offset start in chunks of at
+            most bufsize bytes without holding the whole blob in memory.
+        """
+        return self._git.catFileIter(id, 'blob', bufsize, start)
+
     def blob(self, id):
-        s = self._git.catFile(id, 'blob')
+        s = ''
+        obj = self._git.catFileBatch(id)
+        if obj and obj[1] == 'blob':
+            id = obj[0]
+            s = obj[3]
+
         obj = GitBlob(self, id, data = s)
         return obj
 
 
-    def archive(self, id, project, type):
+    def archive(self, id, project, type, threads = 0):
+        chunks, filename = self.archiveIter(id, project, type, threads)
+        return (''.join(chunks), filename)
+
+    def archiveIter(self, id, project, type, threads = 0):
+        """ Returns tuple (chunks, filename) where chunks is generator
+            yielding archive in chunks as it is produced.
+
+            If threads is greater than zero, tar archives are compressed
+            in-process using the specified number of threads instead of
+            running external compressor.
+        """
         name = project + '-' + id
 
         if type == 'tgz':
-            arch = self._git.archive(id, 'tar', name + '/', 'gzip')
+            compress = 'gzip'
             filename = name + '.tar.gz'
         elif type == 'tbz2':
-            arch = self._git.archive(id, 'tar', name + '/', 'bzip2')
+            compress = 'bzip2'
             filename = name + '.tar.bz2'
         elif type == 'txz':
-            arch = self._git.archive(id, 'tar', name + '/', 'xz')
+            compress = 'xz'
             filename = name + '.tar.xz'
         elif type == 'zip':
-            arch = self._git.archive(id, 'zip', name + '/')
+            arch = self._git.archiveIter(id, 'zip', name + '/')
             filename = name + '.zip'
+            return (arch, filename)
+
+        if threads > 0 and compressmod.supported(compress):
+            arch = self._git.archiveIter(id, 'tar', name + '/')
+            arch = compressmod.parallelIter(arch, compress, threads)
+        else:
+            arch = self._git.archiveIter(id, 'tar', name + '/', compress)
 
         return (arch, filename)
 
@@ -660,6 +1489,42 @@ class Git(object):
                                  comment = comment)
         return commit
 
+    def _parseCommitObj(self, id, s):
+        """ Parses raw commit object (as printed by git cat-file commit) """
+        head, msg = s, ''
+        if '\n\n' in s:
+            head, msg = s.split('\n\n', 1)
+
+        parents   = []
+        tree      = None
+        author    = None
+        committer = None
+        for line in head.split('\n'):
+            if line[:4] == 'tree':
+                tree = line[5:]
+            if line[:6] == 'parent' and line[7:] not in parents:
+                parents.append(line[7:])
+            if line[:6] == 'author':
+                author = self._parsePerson(line)
+            if line[:9] == 'committer':
+                committer = self._parsePerson(line)
+
+        comment = ''
+        lines = [l.rstrip() for l in msg.split('\n')]
+        # trailing whitespaces and blank lines around message are
+        # omitted as git does
+        while len(lines) > 0 and len(lines[-1]) == 0:
+            lines.pop()
+        while len(lines) > 0 and len(lines[0]) == 0:
+            lines.pop(0)
+        for line in lines:
+            comment += line + '\n'
+
+        commit = GitCommit(self, id = id, tree = tree, parents = parents,
+                                 author = author, committer = committer,
+                                 comment = comment)
+        return commit
+
     def _parseTag(self, s):
         lines = s.split('\x00')
 
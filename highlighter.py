@@ -0,0 +1,129 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import time
+import threading
+import multiprocessing
+
+
+def _job(data, lexer, style):
+    """ Highlights data in helper process, lexer is alias of pygments
+        lexer.
+    """
+    from pygments import highlight
+    from pygments.lexers import get_lexer_by_name
+    from pygments.formatters import HtmlFormatter
+
+    lexer = get_lexer_by_name(lexer)
+    formatter = HtmlFormatter(nowrap = True, noclasses = True, style = style)
+    return highlight(data, lexer, formatter)
+
+
+def _run(conn, data, lexer, style):
+    """ Body of helper process, sends (True, html) or (False, error) """
+    try:
+        conn.send((True, _job(data, lexer, style), ))
+    except Exception as e:
+        conn.send((False, str(e), ))
+    conn.close()
+
+
+# Slots limiting number of helper processes running at once (keyed by the
+# limit) and number of jobs which didn't finish yet
+_slots = {}
+_slots_lock = threading.Lock()
+_pending = 0
+
+def _getSlots(processes):
+    _slots_lock.acquire()
+    try:
+        if processes not in _slots:
+            _slots[processes] = threading.BoundedSemaphore(processes)
+        return _slots[processes]
+    finally:
+        _slots_lock.release()
+
+def _addPending(n):
+    global _pending
+
+    _slots_lock.acquire()
+    try:
+        _pending += n
+        return _pending
+    finally:
+        _slots_lock.release()
+
+def _runJob(data, lexer, style, timeout):
+    """ Runs one job in its own helper process, the process is killed if
+        it doesn't finish within timeout seconds. Returns html or None.
+    """
+    recv, send = multiprocessing.Pipe(False)
+    proc = multiprocessing.Process(target = _run,
+                                   args = (send, data, lexer, style))
+    proc.daemon = True
+    proc.start()
+    send.close()
+
+    try:
+        if not recv.poll(timeout):
+            return None
+        try:
+            ok, res = recv.recv()
+        except EOFError:
+            raise RuntimeError('highlighting process died')
+        if not ok:
+            raise RuntimeError(res)
+        return res
+    finally:
+        recv.close()
+        if proc.is_alive():
+            proc.terminate()
+        proc.join()
+
+def highlight(data, lexer, style, processes, timeout):
+    """ Highlights data by pygments lexer (alias of lexer) in helper
+        process, so highlighting doesn't hold GIL of the current process.
+        At most processes helper processes run at once, other jobs wait
+        for a free slot.
+
+        Returns tuple (html, queue, elapsed) where html is None if the job
+        didn't finish within timeout seconds from start of its process
+        (time spent waiting for a slot doesn't count, only the process of
+        this job is killed), queue is number of jobs (including this one)
+        when the job was submitted and elapsed is time in seconds the job
+        ran.
+    """
+    slots = _getSlots(processes)
+
+    queue = _addPending(1)
+    try:
+        slots.acquire()
+        try:
+            start = time.time()
+            html = _runJob(data, lexer, style, timeout)
+            elapsed = time.time() - start
+        finally:
+            slots.release()
+    finally:
+        _addPending(-1)
+
+    return (html, queue, elapsed, )
@@ -0,0 +1,1079 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import os
+import re
+import mmap
+import zlib
+import struct
+import binascii
+import heapq
+import threading
+
+import git
+
+
+obj_types = { 1 : 'commit',
+              2 : 'tree',
+              3 : 'blob',
+              4 : 'tag' }
+
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+# Deltified objects bigger than this (in bytes) are streamed by git instead
+# of being reconstructed in memory of the current process
+max_delta_size = 4 * 1024 * 1024
+
+re_id = re.compile(r'^[0-9a-fA-F]{40}$')
+
+# Characters and sequences forbidden in ref names (see
+# git-check-ref-format(1))
+re_ref_forbidden = re.compile(r'[\x00-\x20\x7f~^:?*\[\\]|\.\.|@\{')
+
+def validRefName(ref):
+    """ Returns True if ref is HEAD or a name under refs/ which passes
+        rules of git check-ref-format, so it can't point outside refs.
+    """
+    if ref == 'HEAD':
+        return True
+    if ref[:5] != 'refs/' or re_ref_forbidden.search(ref):
+        return False
+
+    for part in ref.split('/'):
+        if len(part) == 0 or part[0] == '.' or part[-5:] == '.lock':
+            return False
+    return ref[-1] != '.'
+
+
+class PackIndex(object):
+    """ Reader of pack index file (.idx), both version 1 and 2 """
+
+    def __init__(self, path):
+        f = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        if self._map[:4] == '\377tOc':
+            self._version = struct.unpack('>I', self._map[4:8])[0]
+            self._fanout_pos = 8
+        else:
+            self._version = 1
+            self._fanout_pos = 0
+
+        self._fanout = struct.unpack('>256I',
+                            self._map[self._fanout_pos:self._fanout_pos + 1024])
+        self.num = self._fanout[255]
+
+        if self._version == 1:
+            self._entries_pos = self._fanout_pos + 1024
+        else:
+            self._names_pos   = self._fanout_pos + 1024
+            self._offsets_pos = self._names_pos + self.num * 24
+            self._large_pos   = self._offsets_pos + self.num * 4
+
+    def _name(self, i):
+        if self._version == 1:
+            pos = self._entries_pos + i * 24 + 4
+        else:
+            pos = self._names_pos + i * 20
+        return self._map[pos:pos + 20]
+
+    def _offset(self, i):
+        if self._version == 1:
+            pos = self._entries_pos + i * 24
+            return struct.unpack('>I', self._map[pos:pos + 4])[0]
+
+        pos = self._offsets_pos + i * 4
+        off = struct.unpack('>I', self._map[pos:pos + 4])[0]
+        if off & 0x80000000:
+            pos = self._large_pos + (off & 0x7fffffff) * 8
+            off = struct.unpack('>Q', self._map[pos:pos + 8])[0]
+        return off
+
+    def offset(self, sha):
+        """ Returns offset of object in pack or None. sha is binary (20
+            bytes) object id.
+        """
+        first = ord(sha[0])
+        lo = 0
+        if first > 0:
+            lo = self._fanout[first - 1]
+        hi = self._fanout[first]
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name = self._name(mid)
+            if name < sha:
+                lo = mid + 1
+            elif name > sha:
+                hi = mid
+            else:
+                return self._offset(mid)
+        return None
+
+    def close(self):
+        self._map.close()
+
+
+class Pack(object):
+    """ Reader of objects stored in one pack file (.pack) """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = PackIndex(path[:-5] + '.idx')
+
+        f = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+    def offset(self, sha):
+        return self._index.offset(sha)
+
+    def _entryHeader(self, offset):
+        c = ord(self._map[offset])
+        offset += 1
+        type = (c >> 4) & 0x7
+        size = c & 0xf
+        shift = 4
+        while c & 0x80:
+            c = ord(self._map[offset])
+            offset += 1
+            size |= (c & 0x7f) << shift
+            shift += 7
+        return (type, size, offset, )
+
+    def _inflate(self, offset, size):
+        d = zlib.decompressobj()
+        out = []
+        outlen = 0
+        chunk = max(4096, size + 64)
+        while outlen < size:
+            data = self._map[offset:offset + chunk]
+            if len(data) == 0:
+                break
+            offset += chunk
+            s = d.decompress(data)
+            out.append(s)
+            outlen += len(s)
+            if d.unused_data:
+                break
+        return ''.join(out)
+
+    def _inflateIter(self, offset, size, bufsize, skip):
+        # max_length keeps each piece of output at most bufsize bytes
+        d = zlib.decompressobj()
+        outlen = 0
+        while outlen < size:
+            if d.unconsumed_tail:
+                s = d.decompress(d.unconsumed_tail, bufsize)
+            else:
+                data = self._map[offset:offset + bufsize]
+                if len(data) == 0:
+                    break
+                offset += len(data)
+                s = d.decompress(data, bufsize)
+
+            if len(s) == 0:
+                if d.unused_data:
+                    break
+                continue
+
+            outlen += len(s)
+            if skip >= len(s):
+                skip -= len(s)
+                continue
+            yield s[skip:]
+            skip = 0
+
+    def stream(self, offset, bufsize, skip = 0):
+        """ Returns (type, size, chunks) of object stored on given offset
+            where chunks is generator yielding data of the object (without
+            first skip bytes) in chunks of at most bufsize bytes. Returns
+            None for deltified objects which can't be streamed.
+        """
+        type, size, pos = self._entryHeader(offset)
+        if type == OBJ_OFS_DELTA or type == OBJ_REF_DELTA:
+            return None
+        return (obj_types.get(type), size,
+                self._inflateIter(pos, size, bufsize, skip), )
+
+    def read(self, offset, store):
+        """ Returns (type, data) of object stored on given offset. store is
+            ObjectStore used for resolving REF_DELTA bases.
+        """
+        type, size, pos = self._entryHeader(offset)
+
+        if type == OBJ_OFS_DELTA:
+            base, pos = self._deltaBase(type, pos)
+            base = self.read(offset - base, store)
+        elif type == OBJ_REF_DELTA:
+            base, pos = self._deltaBase(type, pos)
+            base = store.read(base)
+        else:
+            return (obj_types.get(type), self._inflate(pos, size), )
+
+        if not base:
+            return None
+        delta = self._inflate(pos, size)
+        return (base[0], applyDelta(base[1], delta), )
+
+    def _deltaBase(self, type, pos):
+        """ Returns (base, pos) where base is offset of base object for
+            OFS_DELTA or hexadecimal id for REF_DELTA and pos is position
+            of compressed delta data.
+        """
+        if type == OBJ_OFS_DELTA:
+            c = ord(self._map[pos])
+            pos += 1
+            base = c & 0x7f
+            while c & 0x80:
+                c = ord(self._map[pos])
+                pos += 1
+                base = ((base + 1) << 7) | (c & 0x7f)
+            return (base, pos, )
+
+        return (binascii.hexlify(self._map[pos:pos + 20]), pos + 20, )
+
+    def size(self, offset, store):
+        """ Returns (type, size) of object on given offset without
+            inflating whole object.
+        """
+        type, size, pos = self._entryHeader(offset)
+        if type != OBJ_OFS_DELTA and type != OBJ_REF_DELTA:
+            return (obj_types.get(type), size, )
+
+        base, pos = self._deltaBase(type, pos)
+
+        # type is taken from base object
+        if type == OBJ_OFS_DELTA:
+            base_type = self.size(offset - base, store)
+        else:
+            base_type = store.size(base)
+        if not base_type:
+            return None
+        base_type = base_type[0]
+
+        # size of result is stored at the beginning of delta so only few
+        # bytes has to be inflated
+        d = zlib.decompressobj()
+        delta = ''
+        while len(delta) < 20 and not d.unused_data:
+            data = self._map[pos:pos + 512]
+            if len(data) == 0:
+                break
+            pos += 512
+            delta += d.decompress(data)
+
+        src_size, i = _deltaSize(delta, 0)
+        dst_size, i = _deltaSize(delta, i)
+        return (base_type, dst_size, )
+
+    def close(self):
+        self._index.close()
+        self._map.close()
+
+
+def _deltaSize(delta, i):
+    size = 0
+    shift = 0
+    while True:
+        c = ord(delta[i])
+        i += 1
+        size |= (c & 0x7f) << shift
+        shift += 7
+        if not c & 0x80:
+            break
+    return (size, i, )
+
+def applyDelta(base, delta):
+    """ Applies git delta on base data and returns result """
+    src_size, i = _deltaSize(delta, 0)
+    dst_size, i = _deltaSize(delta, i)
+
+    out = []
+    dlen = len(delta)
+    while i < dlen:
+        c = ord(delta[i])
+        i += 1
+        if c & 0x80:
+            # copy from base
+            offset = size = 0
+            for shift in (0, 8, 16, 24):
+                if c & (1 << (shift // 8)):
+                    offset |= ord(delta[i]) << shift
+                    i += 1
+            for shift in (0, 8, 16):
+                if c & (0x10 << (shift // 8)):
+                    size |= ord(delta[i]) << shift
+                    i += 1
+            if size == 0:
+                size = 0x10000
+            out.append(base[offset:offset + size])
+        elif c:
+            # insert new data
+            out.append(delta[i:i + c])
+            i += c
+
+    return ''.join(out)
+
+
+class MissingObject(Exception):
+    """ Object needed by native implementation is not in object database
+        (e.g. it is in alternate object store which can't be read).
+    """
+    pass
+
+
+class ObjectDir(object):
+    """ Loose objects and pack files of one objects directory """
+
+    def __init__(self, path):
+        self.path = path
+        self._packdir = os.path.join(path, 'pack')
+        self._packs = []
+        self._packs_mtime = None
+        self._lock = threading.Lock()
+
+    def packs(self):
+        """ Returns list of Pack objects, the list is reloaded when pack
+            directory changes.
+        """
+        try:
+            mtime = os.stat(self._packdir).st_mtime
+        except OSError:
+            mtime = None
+
+        self._lock.acquire()
+        try:
+            if mtime != self._packs_mtime:
+                self._packs = self._loadPacks(mtime is not None)
+                self._packs_mtime = mtime
+            return self._packs
+        finally:
+            self._lock.release()
+
+    def _loadPacks(self, exists):
+        # packs which are still there are reused, the rest is not closed
+        # because other threads may still read them, they are unmapped
+        # when garbage collected
+        old = dict([(p.path, p) for p in self._packs])
+        packs = []
+
+        if exists:
+            for name in sorted(os.listdir(self._packdir)):
+                if name[-5:] != '.pack':
+                    continue
+                if not os.path.isfile(os.path.join(self._packdir, name[:-5] + '.idx')):
+                    continue
+                path = os.path.join(self._packdir, name)
+                packs.append(old.get(path) or Pack(path))
+        return packs
+
+    def readLoose(self, id):
+        path = os.path.join(self.path, id[:2], id[2:])
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+
+        try:
+            data = zlib.decompress(f.read())
+        finally:
+            f.close()
+
+        head, data = data.split('\x00', 1)
+        type = head.split(' ', 1)[0]
+        return (type, data, )
+
+    def _openLoose(self, id):
+        """ Returns (file, decompressobj, type, size, data) of loose object
+            id where data is inflated part of the object following its
+            header, or None.
+        """
+        path = os.path.join(self.path, id[:2], id[2:])
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+
+        # header ("<type> <size>\0") is at most few tens of bytes
+        d = zlib.decompressobj()
+        try:
+            data = d.decompress(f.read(4096), 64)
+            head, data = data.split('\x00', 1)
+            type, size = head.split(' ', 1)
+            size = int(size)
+        except (zlib.error, ValueError):
+            f.close()
+            return None
+
+        return (f, d, type, size, data, )
+
+    def streamLoose(self, id, bufsize, skip = 0):
+        """ Same as Pack.stream() but for loose object id, returns None if
+            there is no such loose object. Only header of the object is
+            inflated before chunks are consumed.
+        """
+        o = self._openLoose(id)
+        if not o:
+            return None
+        f, d, type, size, data = o
+        return (type, size, self._looseIter(f, d, data, bufsize, skip), )
+
+    def sizeLoose(self, id):
+        """ Returns (type, size) of loose object id or None """
+        o = self._openLoose(id)
+        if not o:
+            return None
+        o[0].close()
+        return (o[2], o[3], )
+
+    def _looseIter(self, f, d, data, bufsize, skip):
+        try:
+            while True:
+                if len(data) > skip:
+                    yield data[skip:]
+                    skip = 0
+                else:
+                    skip -= len(data)
+
+                if d.unconsumed_tail:
+                    data = d.decompress(d.unconsumed_tail, bufsize)
+                else:
+                    raw = f.read(bufsize)
+                    if len(raw) == 0:
+                        data = d.flush()
+                        if len(data) > skip:
+                            yield data[skip:]
+                        break
+                    data = d.decompress(raw, bufsize)
+        finally:
+            f.close()
+
+
+class ObjectStore(object):
+    """ Pure python reader of git object database: loose objects, pack
+        files and refs. No git process is run.
+
+        Objects are looked up in objects directory of the repository and
+        then in object directories listed in objects/info/alternates
+        (repositories created by git clone --shared or --reference).
+    """
+
+    def __init__(self, dir):
+        self._dir = dir
+        self._objdir = ObjectDir(os.path.join(dir, 'objects'))
+        self._alternates = []
+        self._alternates_mtime = None
+        self._lock = threading.Lock()
+
+    def _objectDirs(self):
+        """ Returns list of ObjectDir objects of the repository and of all
+            its alternates.
+        """
+        path = os.path.join(self._objdir.path, 'info', 'alternates')
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+
+        self._lock.acquire()
+        try:
+            if mtime != self._alternates_mtime:
+                self._alternates = []
+                self._readAlternates(self._objdir.path,
+                                     set([os.path.realpath(self._objdir.path)]),
+                                     0)
+                self._alternates_mtime = mtime
+            return [self._objdir] + self._alternates
+        finally:
+            self._lock.release()
+
+    def _readAlternates(self, objdir, seen, depth):
+        # alternates can have alternates too, git follows them up to depth
+        # of 5
+        if depth > 5:
+            return
+
+        try:
+            f = open(os.path.join(objdir, 'info', 'alternates'), 'r')
+            lines = f.read().split('\n')
+            f.close()
+        except IOError:
+            return
+
+        for line in lines:
+            line = line.strip()
+            if len(line) == 0 or line[0] == '#':
+                continue
+
+            # relative paths are relative to the objects directory
+            path = os.path.normpath(os.path.join(objdir, line))
+            real = os.path.realpath(path)
+            if real in seen or not os.path.isdir(path):
+                continue
+            seen.add(real)
+
+            self._alternates.append(ObjectDir(path))
+            self._readAlternates(path, seen, depth + 1)
+
+    def read(self, id):
+        """ Returns (type, data) of object with hexadecimal id or None if
+            there is no such object.
+        """
+        id = id.lower()
+        objdirs = self._objectDirs()
+        for objdir in objdirs:
+            obj = objdir.readLoose(id)
+            if obj:
+                return obj
+
+        sha = binascii.unhexlify(id)
+        for objdir in objdirs:
+            for pack in objdir.packs():
+                off = pack.offset(sha)
+                if off is not None:
+                    return pack.read(off, self)
+        return None
+
+    def size(self, id):
+        """ Returns (type, size) of object or None """
+        id = id.lower()
+        objdirs = self._objectDirs()
+        for objdir in objdirs:
+            obj = objdir.sizeLoose(id)
+            if obj:
+                return obj
+
+        sha = binascii.unhexlify(id)
+        for objdir in objdirs:
+            for pack in objdir.packs():
+                off = pack.offset(sha)
+                if off is not None:
+                    return pack.size(off, self)
+        return None
+
+    def stream(self, id, bufsize, skip = 0):
+        """ Returns (type, size, chunks) of object id where chunks is
+            generator yielding its data (without first skip bytes) in
+            chunks of at most bufsize bytes, so the object is never held in
+            memory as a whole. Returns None if there is no such object or
+            if it is deltified.
+        """
+        id = id.lower()
+        objdirs = self._objectDirs()
+        for objdir in objdirs:
+            obj = objdir.streamLoose(id, bufsize, skip)
+            if obj:
+                return obj
+
+        sha = binascii.unhexlify(id)
+        for objdir in objdirs:
+            for pack in objdir.packs():
+                off = pack.offset(sha)
+                if off is not None:
+                    return pack.stream(off, bufsize, skip)
+        return None
+
+    def shallow(self):
+        """ Returns set of ids of shallow commits (commits whose parents
+            are not present in the repository).
+        """
+        try:
+            f = open(os.path.join(self._dir, 'shallow'), 'r')
+            ids = set([line.strip() for line in f])
+            f.close()
+            return ids
+        except IOError:
+            return set()
+
+    def refs(self):
+        """ Returns dictionary refname -> id of all refs (packed and loose)
+        """
+        refs = {}
+
+        try:
+            f = open(os.path.join(self._dir, 'packed-refs'), 'r')
+            for line in f:
+                if line[0] in '#^':
+                    continue
+                d = line.strip().split(' ', 1)
+                if len(d) == 2:
+                    refs[d[1]] = d[0]
+            f.close()
+        except IOError:
+            pass
+
+        refsdir = os.path.join(self._dir, 'refs')
+        for root, dirs, files in os.walk(refsdir):
+            for name in files:
+                path = os.path.join(root, name)
+                ref = os.path.relpath(path, self._dir).replace(os.sep, '/')
+                id = self._readRefFile(path)
+                if id:
+                    refs[ref] = id
+
+        return refs
+
+    def _readRefFile(self, path, depth = 0):
+        try:
+            f = open(path, 'r')
+            s = f.read().strip()
+            f.close()
+        except IOError:
+            return None
+
+        if s[:5] == 'ref: ':
+            if depth > 5:
+                return None
+            return self._ref(s[5:], depth + 1)
+        if re_id.match(s):
+            return s
+        return None
+
+    def _ref(self, ref, depth = 0):
+        # names come from requests (and from symbolic refs)
+        if not validRefName(ref):
+            return None
+
+        id = self._readRefFile(os.path.join(self._dir, ref), depth)
+        if id:
+            return id
+
+        try:
+            f = open(os.path.join(self._dir, 'packed-refs'), 'r')
+            for line in f:
+                d = line.strip().split(' ', 1)
+                if len(d) == 2 and d[1] == ref:
+                    f.close()
+                    return d[0]
+            f.close()
+        except IOError:
+            pass
+        return None
+
+    def resolve(self, name):
+        """ Resolves simple revision name (full id, HEAD or name of ref)
+            to object id. Returns None if name can't be resolved here,
+            names which are not valid ref names are never looked up.
+        """
+        if re_id.match(name):
+            return name.lower()
+
+        if name == 'HEAD':
+            return self._ref('HEAD')
+
+        for fmt in ['{0}', 'refs/{0}', 'refs/tags/{0}', 'refs/heads/{0}',
+                    'refs/remotes/{0}', 'refs/remotes/{0}/HEAD']:
+            id = self._ref(fmt.format(name))
+            if id:
+                return id
+        return None
+
+    def peel(self, id, type):
+        """ Peels object id (dereferences tags and commits) until object
+            of specified type is found.
+        """
+        while id:
+            # only header of the object is read unless it has to be
+            # dereferenced
+            obj = self.size(id)
+            if not obj:
+                return None
+            if obj[0] == type:
+                return id
+
+            obj = self.read(id)
+            if obj[0] == 'tag':
+                id = obj[1].split('\n', 1)[0][7:]
+            elif obj[0] == 'commit' and type == 'tree':
+                id = obj[1].split('\n', 1)[0][5:]
+            else:
+                return None
+        return None
+
+    def treeEntries(self, id):
+        """ Returns list of (mode, name, id) of tree object. Raises
+            MissingObject if the tree is not in object database.
+        """
+        obj = self.read(id)
+        if not obj:
+            raise MissingObject(id)
+        if obj[0] != 'tree':
+            return []
+
+        data = obj[1]
+        entries = []
+        i = 0
+        while i < len(data):
+            sp = data.index(' ', i)
+            nul = data.index('\x00', sp)
+            mode = data[i:sp]
+            name = data[sp + 1:nul]
+            sha = binascii.hexlify(data[nul + 1:nul + 21])
+            entries.append((mode, name, sha, ))
+            i = nul + 21
+        return entries
+
+    def lookupPath(self, tree, path):
+        """ Returns (mode, id) of path relative to tree id """
+        mode = '40000'
+        for name in filter(lambda x: len(x) > 0, path.split('/')):
+            if mode != '40000':
+                return None
+
+            found = None
+            for entry in self.treeEntries(tree):
+                if entry[1] == name:
+                    found = entry
+                    break
+            if not found:
+                return None
+            mode, tree = found[0], found[2]
+        return (mode, tree, )
+
+
+class GitNative(git.GitComm):
+    """ Drop-in replacement of git.GitComm which reads objects directly from
+        object database instead of running git processes.
+
+        Methods produce exactly same output as corresponding git commands.
+        Revisions which can't be resolved natively (e.g. HEAD~2) and
+        commands without native implementation (diff-tree, archive, ...)
+        fall back to git.GitComm, so do commands which need an object
+        missing in object database.
+    """
+
+    def __init__(self, dir, gitbin = '/usr/bin/git'):
+        super(GitNative, self).__init__(dir, gitbin)
+        self._store = objectStore(dir)
+
+    def _resolve(self, obj):
+        """ Resolves revision specification obj to object id. Supports
+            <rev>, <rev>^{<type>} and <rev>:<path>. Returns None if obj
+            can't be resolved natively.
+        """
+        peel = None
+        path = None
+        if ':' in obj:
+            obj, path = obj.split(':', 1)
+            peel = 'tree'
+        elif obj[-1:] == '}' and '^{' in obj:
+            obj, peel = obj[:-1].split('^{', 1)
+
+        id = self._store.resolve(obj)
+        if id and peel:
+            id = self._store.peel(id, peel)
+        if id and path is not None:
+            try:
+                entry = self._store.lookupPath(id, path)
+            except MissingObject:
+                entry = None
+            id = None
+            if entry:
+                id = entry[1]
+        return id
+
+    def catFileBatch(self, obj = 'HEAD'):
+        id = self._resolve(obj)
+        if not id:
+            return super(GitNative, self).catFileBatch(obj)
+
+        o = self._store.read(id)
+        if not o:
+            return super(GitNative, self).catFileBatch(obj)
+        return (id, o[0], len(o[1]), o[1], )
+
+    def catFileBatchCheck(self, obj = 'HEAD'):
+        id = self._resolve(obj)
+        if not id:
+            return super(GitNative, self).catFileBatchCheck(obj)
+
+        o = self._store.size(id)
+        if not o:
+            return super(GitNative, self).catFileBatchCheck(obj)
+        return (id, o[0], o[1], None, )
+
+    def catFileIter(self, obj = 'HEAD', type = 'blob', bufsize = 65536,
+                          skip = 0):
+        """ Loose and undeltified objects are inflated chunk by chunk.
+            Deltified objects have to be reconstructed in memory, so only
+            the ones up to max_delta_size bytes are read natively, bigger
+            ones are streamed by git.
+        """
+        id = self._resolve(obj)
+        if id:
+            id = self._store.peel(id, type)
+        if id:
+            o = self._store.stream(id, bufsize, skip)
+            if o:
+                return o[2]
+
+            o = self._store.size(id)
+            if o and o[1] <= max_delta_size:
+                o = self._store.read(id)
+                if o:
+                    return self._chunksIter(o[1], bufsize, skip)
+
+        return super(GitNative, self).catFileIter(obj, type, bufsize, skip)
+
+    def _chunksIter(self, data, bufsize, skip):
+        for i in range(skip, len(data), bufsize):
+            yield data[i:i + bufsize]
+
+    def catFileBatchCheckMany(self, objs):
+        return [self.catFileBatchCheck(obj) for obj in objs]
+
+    def catFile(self, obj = 'HEAD', type = 'commit', size = False,
+                      pretty = False):
+        id = self._resolve(obj)
+        if not id or size or pretty:
+            return super(GitNative, self).catFile(obj, type, size, pretty)
+
+        id = self._store.peel(id, type)
+        o = None
+        if id:
+            o = self._store.read(id)
+        if not o:
+            return super(GitNative, self).catFile(obj, type, size, pretty)
+        return o[1]
+
+    def _commitDate(self, data):
+        for line in data.split('\n'):
+            if line[:10] == 'committer ':
+                try:
+                    return int(line.rsplit(' ', 2)[1])
+                except (IndexError, ValueError):
+                    return 0
+            if len(line) == 0:
+                break
+        return 0
+
+    def _commitParents(self, id, data, shallow):
+        parents = []
+        if id in shallow:
+            return parents
+
+        for line in data.split('\n'):
+            if line[:7] == 'parent ':
+                parents.append(line[7:])
+            if len(line) == 0:
+                break
+        return parents
+
+    def revList(self, obj = 'HEAD', parents = False, header = False,
+                      max_count = -1, all = False, skip = 0):
+        return ''.join(self.revListIter(obj, parents, header, max_count, all,
+                                        skip))
+
+    def revListIter(self, obj = 'HEAD', parents = False, header = False,
+                          max_count = -1, all = False, skip = 0):
+        starts = []
+        if all:
+            starts = self._store.refs().values()
+            head = self._store.resolve('HEAD')
+            if head:
+                starts.append(head)
+        elif obj:
+            id = self._resolve(obj)
+            if not id:
+                return super(GitNative, self).revListIter(obj, parents, header,
+                                                          max_count, all, skip)
+            starts = [id]
+
+        return self._revListFallback(obj, starts, parents, header, max_count,
+                                     all, skip)
+
+    def _revListFallback(self, obj, starts, parents, header, max_count, all,
+                               skip):
+        """ Yields output of native rev-list. If a commit is missing in
+            object database, the rest of output is taken from git (the
+            order of commits is the same, so already yielded commits are
+            skipped).
+        """
+        done = 0
+        try:
+            for line in self._revListIter(starts, parents, header, max_count,
+                                          skip):
+                yield line
+                done += 1
+            return
+        except MissingObject:
+            pass
+
+        if max_count > 0:
+            max_count -= done
+        for s in super(GitNative, self).revListIter(obj, parents, header,
+                                                    max_count, all,
+                                                    skip + done):
+            yield s
+
+    def _revListIter(self, starts, parents, header, max_count, skip):
+        shallow = self._store.shallow()
+
+        if skip > 0 and max_count > 0:
+            max_count += skip
+
+        for id, data in self.walk(starts, max_count):
+            if skip > 0:
+                skip -= 1
+                continue
+
+            line = id
+            if parents:
+                line += ''.join([' ' + p for p in self._commitParents(id, data, shallow)])
+
+            if header:
+                head, msg = data, ''
+                if '\n\n' in data:
+                    head, msg = data.split('\n\n', 1)
+                lines = [l.rstrip() for l in msg.split('\n')]
+                # trailing whitespaces and blank lines around message are
+                # omitted as git does
+                while len(lines) > 0 and len(lines[-1]) == 0:
+                    lines.pop()
+                while len(lines) > 0 and len(lines[0]) == 0:
+                    lines.pop(0)
+                line += '\n' + head + '\n\n'
+                line += ''.join(['    ' + l + '\n' for l in lines])
+                line += '\x00'
+            else:
+                line += '\n'
+
+            yield line
+
+    def walk(self, starts, max_count = -1):
+        """ Walks history from commits starts in the same order as
+            git-rev-list(1) does (newest commit first). Yields tuples (id,
+            raw commit data). Raises MissingObject if a commit (other than
+            parent of shallow commit) is not in object database.
+        """
+        queue = []
+        seen = set()
+        seq = 0
+        shallow = self._store.shallow()
+
+        for id in starts:
+            start = id
+            id = self._store.peel(id, 'commit')
+            if not id and not self._store.size(start):
+                raise MissingObject(start)
+            if not id or id in seen:
+                continue
+            seen.add(id)
+            o = self._store.read(id)
+            if not o:
+                raise MissingObject(id)
+            data = o[1]
+            heapq.heappush(queue, (-self._commitDate(data), seq, id, data))
+            seq += 1
+
+        count = 0
+        while queue and (max_count < 0 or count < max_count):
+            date, s, id, data = heapq.heappop(queue)
+            yield (id, data, )
+            count += 1
+
+            for p in self._commitParents(id, data, shallow):
+                if p in seen:
+                    continue
+                seen.add(p)
+                o = self._store.read(p)
+                if not o:
+                    raise MissingObject(p)
+                heapq.heappush(queue, (-self._commitDate(o[1]), seq, p, o[1]))
+                seq += 1
+
+    def lsTree(self, obj = 'HEAD', recursive = False, long = False,
+                     full_tree = False, zeroterm = True, trees = False):
+        id = self._resolve(obj)
+        if id:
+            id = self._store.peel(id, 'tree')
+        if not id:
+            return super(GitNative, self).lsTree(obj, recursive, long,
+                                                 full_tree, zeroterm, trees)
+
+        term = '\n'
+        if zeroterm:
+            term = '\x00'
+
+        out = []
+        try:
+            self._lsTree(id, '', recursive, long, trees, term, out)
+        except MissingObject:
+            return super(GitNative, self).lsTree(obj, recursive, long,
+                                                 full_tree, zeroterm, trees)
+        return ''.join(out)
+
+    def _lsTree(self, id, prefix, recursive, long, trees, term, out):
+        for mode, name, sha in self._store.treeEntries(id):
+            if mode == '40000':
+                type = 'tree'
+            elif mode == '160000':
+                type = 'commit'
+            else:
+                type = 'blob'
+
+            if recursive and type == 'tree' and not trees:
+                self._lsTree(sha, prefix + name + '/', recursive, long, trees,
+                             term, out)
+                continue
+
+            line = '{0:0>6} {1} {2}'.format(mode, type, sha)
+            if long:
+                size = '-'
+                if type == 'blob':
+                    o = self._store.size(sha)
+                    if not o:
+                        raise MissingObject(sha)
+                    size = str(o[1])
+                line += ' {0: >7}'.format(size)
+            line += '\t' + prefix + name + term
+            out.append(line)
+
+            if recursive and type == 'tree':
+                self._lsTree(sha, prefix + name + '/', recursive, long, trees,
+                             term, out)
+
+
+# ObjectStore objects shared by all requests handled by the current process
+_stores = {}
+_stores_lock = threading.Lock()
+
+def objectStore(dir):
+    global _stores
+
+    _stores_lock.acquire()
+    try:
+        store = _stores.get(dir)
+        if store is None:
+            store = ObjectStore(dir)
+            _stores[dir] = store
+    finally:
+        _stores_lock.release()
+
+    return store
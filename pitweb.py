@@ -13,6 +13,14 @@ project_name = 'ProjectName'
 # Default value is 50.
 commits_per_page = 50
 
+### Pagination of Log section by cursor
+# If True, link to the next page carries ids of commits from which the next
+# page continues instead of number of commits to skip, so far pages cost the
+# same as the first one. History with commits newer than their children
+# (clock skew) is paged by skipping commits.
+# Default value is False
+log_cursor = False
+
 ### Number of commits shown in Summary section
 # Default value is 15
 commits_in_summary = 15
@@ -37,3 +45,98 @@ homepage = 'http://project.net'
 # Available formats are 'tgz', 'tbz2', 'txz', 'zip'
 # Default value is ['tgz', 'tbz2']
 snapshots = ['tgz', 'tbz2', 'txz', 'zip']
+
+### Backend used for reading git repository
+# 'git' runs git commands, 'native' reads objects, packs and refs directly
+# from the repository without running git (commands which can't be served
+# natively still run git). Objects of alternate object stores
+# (objects/info/alternates) are read too. check_objstore.py compares output
+# of both backends on given repositories.
+# Default value is 'git'
+backend = 'git'
+
+### Directory where pitweb can store cached data of this project
+# (e.g. generated snapshots). It must be writable by web server.
+# Caching is disabled if it is not set.
+# Default value is None
+cache_dir = None
+
+### Maximal total size (in bytes) of snapshots stored in cache
+# Least recently downloaded snapshots are removed when the limit is exceeded.
+# Default value is 1GB
+snapshot_cache_size = 1024 * 1024 * 1024
+
+### Number of threads used for compression of tar snapshots
+# If greater than zero, tgz, tbz2 (and txz if python lzma module is
+# available) snapshots are compressed in-process in parallel, otherwise
+# external gzip, bzip2 or xz program is used.
+# Default value is 0
+snapshot_threads = 0
+
+### Maximal total size (in bytes) of file indexes stored in cache
+# File index (list of all paths of a tree used by the find action and the
+# tree view) is stored in cache_dir keyed by id of tree.
+# Default value is 100MB
+file_index_cache_size = 100 * 1024 * 1024
+
+### Show sizes of files in tree view
+# Setting it to False saves reading headers of all blobs in listed
+# directory.
+# Default value is True
+tree_sizes = True
+
+### Look up sizes of files in tree view in persistent cache
+# If True (and cache_dir is set), sizes of blobs are stored in
+# cache_dir/blob-sizes.db and only sizes of blobs not found there are asked
+# from git. It pays off only if reading sizes is expensive for git (e.g.
+# long delta chains), otherwise ls-tree --long is faster.
+# Default value is False
+tree_size_cache = False
+
+### Maximal size (in bytes) of the cache of sizes of files
+# Least recently used sizes are removed when the limit is exceeded.
+# Default value is 10MB
+tree_size_cache_size = 10 * 1024 * 1024
+
+### Number of lines of file shown at once in blob view
+# Longer files are split into windows with navigation between them.
+# Default value is 1000
+blob_lines_per_page = 1000
+
+### Maximal size (in bytes) of file which is highlighted in blob view
+# Bigger files are shown as plain text.
+# Default value is 256KB
+highlight_max_size = 256 * 1024
+
+### Maximal total size (in bytes) of highlighted files stored in cache
+# Files highlighted in blob view are stored in cache_dir keyed by id of
+# blob, so each version of file is highlighted only once.
+# Default value is 100MB
+highlight_cache_size = 100 * 1024 * 1024
+
+### Number of helper processes used for highlighting
+# If greater than zero, each file is highlighted in its own helper process
+# instead of the web server process, so highlighting of a big file doesn't
+# block other requests. At most this number of helper processes run at once,
+# other files wait for a free slot. Time of each job and number of queued
+# jobs are logged on info level.
+# Default value is 0
+highlight_processes = 0
+
+### Time limit (in seconds) of highlighting in helper process
+# If highlighting takes longer (waiting for a free slot doesn't count), the
+# helper process is killed and file is shown as plain text.
+# Default value is 5
+highlight_timeout = 5.
+
+### Max-age (in seconds) of pages addressed by symbolic names
+# Commit, diff, tree and blob pages are sent with ETag and can be
+# revalidated, pages addressed by names like HEAD or a branch can be cached
+# by browsers and proxies for this time.
+# Default value is 60
+http_max_age = 60
+
+### Max-age (in seconds) of pages addressed by full ids of objects
+# Such pages never change.
+# Default value is one year
+http_max_age_immutable = 365 * 24 * 3600
@@ -27,8 +27,10 @@ import re
 import math
 import mimetypes
 import os
-import imp
+import urllib
+import sqlite3
 import hashlib
+import email.utils
 
 pygments = False
 try:
@@ -40,7 +42,22 @@ except:
     pass
 
 import common
+import cache
 import git
+import objstore
+import project_config
+import highlighter
+
+
+# Lexers found for names of files (False if there is no lexer for the file)
+lexer_cache = cache.LRUCache(1000)
+
+# HtmlFormatter objects keyed by style
+_formatters = {}
+
+# Highlighted blobs keyed by (blob id, lexer, style) used by projects
+# without cache_dir
+highlight_cache = cache.LRUCache(16)
 
 
 class ProjectBase(common.ModPythonOutput):
@@ -51,41 +68,27 @@ class ProjectBase(common.ModPythonOutput):
 
         self._dir = dir
 
-        self._git = git.Git(dir)
-
         self._errors = []
         self._status = apache.OK
+        self._etag = None
+        self._degraded = False
 
         self._config()
         self._params()
 
-    def _config(self):
-        config = None
+        comm = None
+        if self._backend == 'native':
+            comm = objstore.GitNative(dir)
+        self._git = git.Git(dir, comm = comm)
 
-        # Load configuration from file
-        if os.path.exists(os.path.join(self._dir, 'pitweb.py')):
-            file = pathname = desc = None
-            try:
-                file, pathname, desc = imp.find_module('pitweb', [self._dir]) 
-            except ImportError:
-                pass
-
-            try:
-                if file and pathname and desc:
-                    f = open(pathname, 'r')
-                    hash = hashlib.sha256(pathname + f.read())
-                    f.close()
-
-                    name = 'config-' + hash.hexdigest()
-
-                    config = imp.load_module(name, file, pathname, desc)
-            except Exception as e:
-                msg = "Can't load configuration file: "
-                msg += str(e)
-                self._errors.append(msg)
+    def _config(self):
+        config, error = project_config.load(self._dir)
+        if error:
+            self._errors.append(error)
 
         self._setProjectName(config)
         self._commits_per_page = self._configParam(config, 'commits_per_page', 50)
+        self._log_cursor = self._configParam(config, 'log_cursor', False)
         self._commits_in_summary = self._configParam(config, 'commits_in_summary', 15)
         self._description = self._configParam(config, 'description', None)
         self._owner = self._configParam(config, 'owner', None)
@@ -93,28 +96,27 @@ class ProjectBase(common.ModPythonOutput):
         self._homepage = self._configParam(config, 'homepage', None)
         self._one_line_comment_max_len = self._configParam(config, 'one_line_comment_max_len', 50)
         self._setSnapshots(config)
+        self._backend = self._configParam(config, 'backend', 'git')
+        self._cache_dir = self._configParam(config, 'cache_dir', None)
+        self._snapshot_cache_size = self._configParam(config, 'snapshot_cache_size', 1024 * 1024 * 1024)
+        self._snapshot_threads = self._configParam(config, 'snapshot_threads', 0)
+        self._file_index_cache_size = self._configParam(config, 'file_index_cache_size', 100 * 1024 * 1024)
+        self._tree_sizes = self._configParam(config, 'tree_sizes', True)
+        self._tree_size_cache = self._configParam(config, 'tree_size_cache', False)
+        self._tree_size_cache_size = self._configParam(config, 'tree_size_cache_size', 10 * 1024 * 1024)
+        self._blob_lines_per_page = self._configParam(config, 'blob_lines_per_page', 1000)
+        self._highlight_max_size = self._configParam(config, 'highlight_max_size', 256 * 1024)
+        self._highlight_cache_size = self._configParam(config, 'highlight_cache_size', 100 * 1024 * 1024)
+        self._highlight_processes = self._configParam(config, 'highlight_processes', 0)
+        self._highlight_timeout = self._configParam(config, 'highlight_timeout', 5.)
+        self._http_max_age = self._configParam(config, 'http_max_age', 60)
+        self._http_max_age_immutable = self._configParam(config, 'http_max_age_immutable', 365 * 24 * 3600)
 
     def _configParam(self, config, name, default):
-        if config and hasattr(config, name):
-            return getattr(config, name)
-        return default
+        return project_config.param(config, name, default)
 
     def _setProjectName(self, config):
-        name = self._configParam(config, 'project_name', None)
-        if name:
-            self._project_name = name
-            return
-
-        name = ''
-
-        p = self._dir.split('/')
-        p = filter(lambda x: len(x) > 0, p)
-        if len(p) > 0:
-            name = p[-1]
-            if len(name) > 4 and name[-4:] == '.git':
-                name = name[:-4]
-
-        self._project_name = name
+        self._project_name = project_config.projectName(self._dir, config)
 
     def _setSnapshots(self, config):
         snapshots = self._configParam(config, 'snapshots', ['tgz', 'tbz2'])
@@ -147,8 +149,15 @@ class ProjectBase(common.ModPythonOutput):
             self._showmsg = True
 
         self._page    = int(args.get('page', '1'))
+        self._cursor  = filter(lambda x: git.patterns['id'].match(x),
+                               args.get('from', '').split(','))
+        self._listed  = filter(lambda x: git.patterns['id'].match(x),
+                               args.get('listed', '').split(','))
         self._path    = args.get('path', '')
         self._format  = args.get('format', 'tgz')
+        self._query   = args.get('q', '')
+        self._lines   = args.get('lines', '')
+        self._line    = args.get('line', '')
 
     def _parseArgs(self):
         args = {}
@@ -160,11 +169,13 @@ class ProjectBase(common.ModPythonOutput):
         if strargs[0] == '?':
             strargs = strargs[1:]
 
-        hunks = strargs.split(';')
+        # forms submit arguments separated by & and url-encoded, so are
+        # values in links (see anchor())
+        hunks = strargs.replace('&', ';').split(';')
         for hunk in hunks:
             s = hunk.split('=', 1)
             if len(s) == 2:
-                args[s[0]] = s[1]
+                args[urllib.unquote_plus(s[0])] = urllib.unquote_plus(s[1])
 
         return args
 
@@ -182,18 +193,132 @@ class ProjectBase(common.ModPythonOutput):
         return default
 
     def lastChange(self, default = ''):
-        commits = self._git.revList(None, all = True, max_count = 1)
-        if len(commits) > 0:
-            date   = commits[0].committer.date
+        for commit in self._git.revListIter(None, all = True, max_count = 1):
+            date   = commit.committer.date
             date   = date.format('%Y-%m-%d %H:%M:%S')
             return date
         return ''
 
 
+    def _validators(self):
+        """ Returns tuple (etag, last modified, immutable) for pages which
+            are given only by objects named in arguments (commit, diff,
+            tree, blob, ...), or None for other pages or if some of the
+            objects can't be resolved.
+
+            Page is immutable if all objects are named by full ids. Last
+            modified (committer date) is given only for immutable pages
+            because symbolic name can move to an older commit.
+        """
+        names = { 'commit'   : [self._id],
+                  'diff'     : [self._id, self._id2],
+                  'patch'    : [self._id, self._id2],
+                  'tree'     : [self._id, self._treeid],
+                  'blob'     : [self._id, self._blobid, self._treeid],
+                  'blob-raw' : [self._blobid],
+                  'snapshot' : [self._id] }.get(self._a)
+        if names is None:
+            return None
+        names = filter(lambda x: x is not None, names)
+
+        ids = []
+        for name in names:
+            id = self._git.resolve(name)
+            if not id:
+                return None
+            ids.append(id)
+
+        immutable = len(filter(lambda x: not git.patterns['id'].match(x), names)) == 0
+
+        # output depends also on other arguments and configuration
+        self._etag_parts = [self._req.args or '', repr(project_config.fingerprint(self._dir))] + ids
+        etag = self._etagOf(self._etag_parts, 'full')
+
+        last_modified = None
+        if immutable and self._a != 'blob-raw':
+            for name in names:
+                commit = self._git.commit(name)
+                if commit:
+                    last_modified = max(last_modified, commit.committer.date.epoch)
+
+        return (etag, last_modified, immutable, )
+
+    def _etagOf(self, parts, mode):
+        """ Returns ETag of page given by parts rendered in mode ('full'
+            or 'degraded', see _setDegraded())
+        """
+        return '"' + hashlib.sha1('\x00'.join(parts + [mode])).hexdigest() + '"'
+
+    def _setDegraded(self):
+        """ Marks the page as rendered in degraded mode (e.g. highlighting
+            timed out and the blob is shown as plain text). Such page gets
+            its own ETag and must not be cached, the next request renders
+            it again.
+        """
+        self._degraded = True
+        if self._etag is None:
+            return
+
+        self._etag = self._etagOf(self._etag_parts, 'degraded')
+        self._req.headers_out['ETag'] = self._etag
+        self._req.headers_out['Cache-Control'] = 'no-cache'
+        if 'Last-Modified' in self._req.headers_out:
+            del self._req.headers_out['Last-Modified']
+
+    def _notModified(self):
+        """ Sets validators and caching headers of the response. Returns
+            True if client's copy is still valid (page need not be
+            generated).
+        """
+        self._etag = None
+        self._etag_parts = None
+        self._last_modified = None
+        self._degraded = False
+
+        validators = self._validators()
+        if validators is None:
+            return False
+        self._etag, self._last_modified, immutable = validators
+
+        headers = {}
+        headers['ETag'] = self._etag
+        if immutable:
+            headers['Cache-Control'] = 'max-age={0}'.format(self._http_max_age_immutable)
+        else:
+            headers['Cache-Control'] = 'max-age={0}'.format(self._http_max_age)
+        if self._last_modified is not None:
+            headers['Last-Modified'] = email.utils.formatdate(self._last_modified,
+                                                              usegmt = True)
+
+        not_modified = False
+        inm = self._req.headers_in.get('If-None-Match')
+        ims = self._req.headers_in.get('If-Modified-Since')
+        if inm:
+            tags = [t.strip() for t in inm.split(',')]
+            tags = [t[2:] if t[:2] == 'W/' else t for t in tags]
+            not_modified = '*' in tags or self._etag in tags
+        elif ims and self._last_modified is not None:
+            date = email.utils.parsedate_tz(ims)
+            if date:
+                not_modified = self._last_modified <= email.utils.mktime_tz(date)
+
+        # headers of 304 response are taken from err_headers_out
+        out = self._req.headers_out
+        if not_modified:
+            out = self._req.err_headers_out
+        for k in headers:
+            out[k] = headers[k]
+
+        return not_modified
+
     def run(self):
         self._section = self._a
+        if self._notModified():
+            return apache.HTTP_NOT_MODIFIED
+
         if self._a == 'log':
-            self.log(id = self._id, showmsg = self._showmsg, page = self._page)
+            self.log(id = self._id, showmsg = self._showmsg, page = self._page,
+                     cursor = self._cursor, listed = self._listed)
         elif self._a == 'refs':
             self.refs()
         elif self._a == 'summary':
@@ -206,10 +331,13 @@ class ProjectBase(common.ModPythonOutput):
             self.patch(id = self._id, id2 = self._id2)
         elif self._a == 'tree':
             self.tree(id = self._id, treeid = self._treeid, path = self._path)
+        elif self._a == 'find':
+            self.find(id = self._id, query = self._query)
         elif self._a == 'blob':
             self._section = 'tree'
             self.blob(id = self._id, blobid = self._blobid, treeid = self._treeid, \
-                      path = self._path, filename = self._filename)
+                      path = self._path, filename = self._filename,
+                      lines = self._lines, line = self._line)
         elif self._a == 'blob-raw':
             self.blobRaw(blobid = self._blobid, filename = self._filename)
         elif self._a == 'snapshot':
@@ -226,7 +354,7 @@ class Project(ProjectBase):
 
         self._projects = projects
 
-    def _fileOut(self, data, filename):
+    def _fileOutHeaders(self, filename):
         type = mimetypes.guess_type(filename)
         mime_type = type[0]
         if not mime_type:
@@ -234,13 +362,28 @@ class Project(ProjectBase):
 
         self.setContentType(mime_type)
         self.setFilename(filename)
+
+    def _fileOut(self, data, filename):
+        self._fileOutHeaders(filename)
         self.write(data)
 
+    def _fileOutIter(self, chunks, filename):
+        """ Same as _fileOut() but data are written chunk by chunk as they
+            are yielded by chunks generator.
+        """
+        self._fileOutHeaders(filename)
+        try:
+            for chunk in chunks:
+                self.write(chunk)
+        finally:
+            chunks.close()
+
 
     def anchor(self, html, cls, v):
         href = '?'
         for k in v:
-            href += '{k}={v};'.format(k = k, v = v[k])
+            val = urllib.quote_plus(str(v[k]), safe = '/:,~^')
+            href += '{k}={v};'.format(k = k, v = val)
 
         app = ''
         if cls and len(cls) > 0:
@@ -249,32 +392,54 @@ class Project(ProjectBase):
         return '<a href="{href}"{app}>{html}</a>'.format(html = html, href = href, app = app)
 
 
-    def anchorLog(self, html, id, showmsg, page, cls = ''):
+    def anchorLog(self, html, id, showmsg, page, cls = '', cursor = None,
+                        listed = None):
         if showmsg:
             showmsg = '1'
         else:
             showmsg = '0'
-        return self.anchor(html, cls = cls, v = { 'a' : 'log', 'id' : id, 'showmsg' : showmsg, 'page' : page })
+        v = { 'a' : 'log', 'id' : id, 'showmsg' : showmsg, 'page' : page }
+        if cursor:
+            v['from'] = ','.join(cursor)
+        if cursor and listed:
+            v['listed'] = ','.join(listed)
+        return self.anchor(html, cls = cls, v = v)
 
     def anchorCommit(self, html, id, cls = ''):
         return self.anchor(html, v = { 'a' : 'commit', 'id' : id }, cls = cls)
 
 
-    def log(self, id = 'HEAD', showmsg = False, page = 1):
-        max_count = self._commits_per_page * page;
-        commits = self._git.revList(id, max_count = max_count)
-        commits = commits[self._commits_per_page * (page - 1):]
+    def log(self, id = 'HEAD', showmsg = False, page = 1, cursor = None,
+                  listed = None):
+        # In cursor mode the next link carries ids of commits from which the
+        # next page continues (and of already listed commits which can be
+        # reached again), so any page costs the same. Otherwise commits of
+        # previous pages are skipped, so is history which isn't ordered by
+        # dates (see Git.revListFrom()).
+        res = None
+        if cursor:
+            res = self._git.revListFrom(cursor, self._commits_per_page,
+                                        listed or [])
+        elif self._log_cursor and page <= 1:
+            res = self._git.revListFrom([id], self._commits_per_page)
+
+        next = None
+        next_listed = []
+        if res is not None:
+            commits, next, next_listed = res
+        else:
+            skip = self._commits_per_page * (page - 1)
+            commits = self._git.revList(id, max_count = self._commits_per_page, skip = skip)
+
+        # too long cursor (history with many branches) isn't put into url
+        if next is not None and len(next) + len(next_listed) > 20:
+            next = None
 
         tags, heads, remotes = self._git.refs()
         commits = self._git.commitsSetRefs(commits, tags, heads, remotes)
 
         html = ''
 
-        if not showmsg:
-            expand = self.anchorLog('Expand', id, not showmsg, page)
-        else:
-            expand = self.anchorLog('Collapse', id, not showmsg, page)
-
         # Navigation
         nav = ''
         nav += '<div class="log_nav">'
@@ -285,11 +450,18 @@ class Project(ProjectBase):
 
         nav += '<span class="sep">|</span>'
 
-        nav += self.anchorLog('next', id, showmsg, page + 1)
+        if next is None:
+            nav += self.anchorLog('next', id, showmsg, page + 1)
+        elif len(next) == 0:
+            nav += '<span>next</span>'
+        else:
+            nav += self.anchorLog('next', id, showmsg, page + 1, cursor = next,
+                                  listed = next_listed)
         nav += '</div>'
 
         html += nav
-        html += self._fLog(commits, longcomment = True, id = id, showmsg = showmsg, page = page)
+        html += self._fLog(commits, longcomment = True, id = id, showmsg = showmsg, page = page,
+                           cursor = cursor, listed = listed)
         html += nav
 
         self.write(self.tpl(html))
@@ -342,16 +514,19 @@ class Project(ProjectBase):
 
     def commit(self, id):
         commit = self._git.commit(id)
+        if not commit:
+            self._setStatus(apache.HTTP_NOT_FOUND)
+            return
+
         parent = None
         if len(commit.parents) == 1:
             parent = commit.parents[0]
         diff_trees = self._git.diffTree(id, parent, patch = True)
 
         html = ''
-        if commit:
-            html += self._fCommitInfo(commit)
-            html += '<br />'
-            html += self._fDiffTree(diff_trees)
+        html += self._fCommitInfo(commit)
+        html += '<br />'
+        html += self._fDiffTree(diff_trees)
 
         self.write(self.tpl(html))
 
@@ -372,21 +547,26 @@ class Project(ProjectBase):
     def tree(self, id, treeid, path = ''):
         html = ''
 
-        objs = self._git.tree(id = treeid)
-
         spath = path.split('/')
         spath = filter(lambda x: len(x) > 0, spath)
-        for p in spath:
-            found = False
-            for obj in objs:
-                if type(obj) is git.GitTree \
-                   and obj.name == p:
-                    objs = self._git.tree(id = obj.id)
-                    found = True
-                    break
 
-            if not found:
-                break
+        index = self._git.fileIndex(treeid, self._fileIndexCache(), build = False)
+        if index is not None:
+            objs = self._git.treeFromIndex(index, path)
+            if not self._tree_sizes:
+                for obj in objs:
+                    obj.size = ''
+        else:
+            objs = []
+            subtree, subpath = self._git.treePath(treeid, path)
+            if subtree:
+                size_cache = self._blobSizeCache()
+                try:
+                    objs = self._git.tree(id = subtree, sizes = self._tree_sizes,
+                                          size_cache = size_cache)
+                finally:
+                    if size_cache:
+                        size_cache.close()
 
         html += self._fTreePath(path, treeid)
         html += '<br />'
@@ -454,25 +634,212 @@ class Project(ProjectBase):
         self.write(self.tpl(html))
 
 
-    def blob(self, id, blobid, treeid, path = '', filename = ''):
+    def find(self, id, query):
+        html = ''
+
+        html += '<form method="get" class="find">'
+        html += '<input type="hidden" name="a" value="find" />'
+        html += '<input type="hidden" name="id" value="{0}" />'.format(self._escAttr(id))
+        html += '<input type="text" name="q" size="40" value="{0}" />'.format(self._escAttr(query))
+        html += ' <input type="submit" value="find file" />'
+        html += '</form>'
+
+        if len(query) > 0:
+            files = []
+            index = self._git.fileIndex(id, self._fileIndexCache())
+            if index is not None:
+                files = index.find(query)
+
+            html += '<br />'
+            html += '<table class="tree">'
+            for path, info in files:
+                mode, type, blobid = info.split()[:3]
+
+                dir, filename = '', path
+                if '/' in path:
+                    dir, filename = path.rsplit('/', 1)
+
+                v = { 'a'        : 'blob',
+                      'id'       : id,
+                      'blobid'   : blobid,
+                      'treeid'   : id,
+                      'path'     : dir,
+                      'filename' : filename }
+                vraw = { 'a'        : 'blob-raw',
+                         'filename' : filename,
+                         'blobid'   : blobid }
+
+                menu  = self.anchor('blob', v = v, cls = 'menu')
+                menu += '|'
+                menu += self.anchor('raw', v = vraw, cls = 'menu')
+
+                html += '<tr>'
+                html += '<td>' + self.anchor(self._esc(path), v = v, cls = 'blob') + '</td>'
+                html += '<td>' + menu + '</td>'
+                html += '</tr>'
+            html += '</table>'
+
+            if len(files) == 0:
+                html += 'No file found.'
+
+        self.write(self.tpl(html))
+
+    def _blobSizeCache(self):
+        if not self._cache_dir or not self._tree_sizes or not self._tree_size_cache:
+            return None
+        try:
+            return cache.SQLiteCache(os.path.join(self._cache_dir, 'blob-sizes.db'),
+                                     self._tree_size_cache_size)
+        except sqlite3.Error:
+            return None
+
+    def _fileIndexCache(self):
+        if not self._cache_dir:
+            return None
+        return cache.DiskCache(os.path.join(self._cache_dir, 'file-index'),
+                               self._file_index_cache_size)
+
+
+    def blob(self, id, blobid, treeid, path = '', filename = '', lines = '',
+                   line = ''):
         html = ''
 
         blob = self._git.blob(blobid)
+        blob_lines, first, last, total = self._blobLines(blob, filename,
+                                                         lines, line)
+
+        v = { 'a'        : 'blob',
+              'id'       : id,
+              'blobid'   : blobid,
+              'treeid'   : treeid,
+              'path'     : path,
+              'filename' : filename }
+        nav = self._fBlobNav(v, first, last, total)
 
         html += self._fTreePath(path, treeid, filename, blobid)
         html += '<br />'
-        html += self._fBlob(blob, filename)
+        html += nav
+        html += self._fBlob(blob_lines, first, total)
+        html += nav
 
         self.write(self.tpl(html))
 
+    def _blobWindow(self, total, lines, line):
+        """ Returns tuple (first, last) of numbers of lines (counted from
+            1) which are shown. At most blob_lines_per_page lines are shown,
+            from line line or in range lines ('first-last').
+        """
+        per_page = max(self._blob_lines_per_page, 1)
+
+        first = 1
+        last  = None
+        try:
+            if len(line) > 0:
+                first = int(line)
+            elif len(lines) > 0:
+                r = lines.split('-', 1)
+                first = int(r[0])
+                if len(r) == 2 and len(r[1]) > 0:
+                    last = int(r[1])
+        except ValueError:
+            pass
+
+        first = max(min(first, total), 1)
+        if last is None or last < first:
+            last = first + per_page - 1
+        last = min(last, first + per_page - 1, total)
+
+        return (first, last, )
+
 
     def blobRaw(self, blobid, filename):
-        blob = self._git.blob(blobid)
-        return self._fileOut(blob.data, filename)
+        id = self._git.resolve(blobid, 'blob')
+        if not id:
+            self._setStatus(apache.HTTP_NOT_FOUND)
+            return
+
+        size = self._git.blobSizes([id]).get(id, 0)
+
+        # blob is streamed from git, so memory doesn't depend on its size
+        range = self.parseRange(size, self._etag, self._last_modified)
+        if range is False:
+            self._req.err_headers_out['Content-Range'] = 'bytes */{0}'.format(size)
+            self._setStatus(apache.HTTP_REQUESTED_RANGE_NOT_SATISFIABLE)
+            return
+
+        self._fileOutHeaders(filename)
+        self._req.headers_out['Accept-Ranges'] = 'bytes'
+
+        if range:
+            first, last = range
+            self._req.status = apache.HTTP_PARTIAL_CONTENT
+            self._req.headers_out['Content-Range'] = 'bytes {0}-{1}/{2}'.format(first, last, size)
+            chunks = self._headIter(self._git.blobIter(id, start = first),
+                                    last - first + 1)
+            size = last - first + 1
+        else:
+            chunks = self._git.blobIter(id)
+
+        self._req.set_content_length(size)
+        try:
+            for chunk in chunks:
+                self.write(chunk)
+        finally:
+            chunks.close()
+
+    def _headIter(self, chunks, length):
+        """ Yields first length bytes of data yielded by chunks """
+        try:
+            for chunk in chunks:
+                part = chunk[:length]
+                length -= len(part)
+                if len(part) > 0:
+                    yield part
+                if length <= 0:
+                    break
+        finally:
+            chunks.close()
 
     def snapshot(self, id, format):
-        (data, filename) = self._git.archive(id, self._project_name, format)
-        return self._fileOut(data, filename)
+        (chunks, filename) = self._git.archiveIter(id, self._project_name, format,
+                                                   self._snapshot_threads)
+
+        tree = None
+        if self._cache_dir:
+            tree = self._git.resolve(id, 'tree')
+        if not tree:
+            return self._fileOutIter(chunks, filename)
+
+        snapshots = cache.DiskCache(os.path.join(self._cache_dir, 'snapshots'),
+                                    self._snapshot_cache_size)
+        prefix = self._project_name + '-' + id + '/'
+        key = '\x00'.join([tree, prefix, format])
+
+        path = snapshots.get(key)
+        if path:
+            try:
+                self._fileOutHeaders(filename)
+                return self.sendFile(path)
+            except (IOError, OSError):
+                # the file was evicted in the meantime
+                pass
+
+        writer = snapshots.writer(key)
+        try:
+            self._fileOutIter(self._teeIter(chunks, writer), filename)
+        except:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def _teeIter(self, chunks, out):
+        """ Yields chunks and writes them also to out """
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+                yield chunk
+        finally:
+            chunks.close()
 
     def pull(self, path):
         if path.find('..') >= 0:
@@ -520,29 +887,174 @@ class Project(ProjectBase):
 
         return html
 
-    def _fBlob(self, blob, filename = ''):
+    def _fBlobNav(self, v, first, last, total):
+        """ Returns navigation between windows of lines of blob """
+        if first <= 1 and last >= total:
+            return ''
+
+        per_page = max(self._blob_lines_per_page, 1)
+
         html = ''
+        html += '<div class="blob_nav">'
+        html += 'lines {0}-{1} of {2}'.format(first, last, total)
+        html += '<span class="sep">|</span>'
+
+        if first <= 1:
+            html += '<span>prev</span>'
+        else:
+            v['lines'] = '{0}-{1}'.format(max(first - per_page, 1), first - 1)
+            html += self.anchor('prev', v = v, cls = '')
+
+        html += '<span class="sep">|</span>'
 
-        data = blob.data
+        if last >= total:
+            html += '<span>next</span>'
+        else:
+            v['lines'] = '{0}-{1}'.format(last + 1, min(last + per_page, total))
+            html += self.anchor('next', v = v, cls = '')
+        del v['lines']
 
-        lexer     = None
-        formatter = None
-        if pygments and len(filename) > 0:
+        html += '<span class="sep">|</span>'
+        html += '<form method="get" class="blob_nav">'
+        for k in v:
+            html += '<input type="hidden" name="{0}" value="{1}" />'.format(k, self._escAttr(v[k]))
+        html += 'line <input type="text" name="line" size="6" />'
+        html += '</form>'
+        html += '</div>'
+        return html
+
+    def _blobLines(self, blob, filename = '', lines = '', line = ''):
+        """ Returns tuple (lines, first, last, total) where lines is list
+            of lines first to last (see _blobWindow()) of blob formatted as
+            HTML and total is number of lines of blob. Only lines in the
+            window are split out and escaped. Blobs bigger than
+            highlight_max_size are not highlighted.
+        """
+        data = self._highlight(blob, filename)
+        if data is None:
+            data = blob.data
+
+        total = data.count('\n')
+        if len(data) > 0 and data[-1] != '\n':
+            total += 1
+        first, last = self._blobWindow(total, lines, line)
+
+        out = data.split('\n', last)[first - 1:last]
+        if data is blob.data:
+            out = map(lambda x: self._esc(x), out)
+
+        return (out, first, last, total, )
+
+    def _highlight(self, blob, filename, style = 'trac'):
+        """ Returns blob highlighted by pygments (HTML) or None if it can't
+            be highlighted.
+
+            Blobs are immutable so the result is cached keyed by (blob id,
+            lexer, style), in cache_dir if it is set or in memory otherwise.
+        """
+        if not pygments or len(filename) == 0 \
+           or len(blob.data) > self._highlight_max_size:
+            return None
+
+        lexer = self._lexer(filename)
+        if not lexer:
+            return None
+
+        key = None
+        if git.patterns['id'].match(blob.id):
+            key = '\x00'.join([blob.id, lexer.name, style])
+            data = self._highlightCacheGet(key)
+            if data is not None:
+                return data
+
+        try:
+            if self._highlight_processes > 0 and lexer.aliases:
+                data = self._highlightInPool(blob, lexer.aliases[0], style)
+                if data is None:
+                    self._setDegraded()
+                    return None
+            else:
+                if style not in _formatters:
+                    _formatters[style] = HtmlFormatter(nowrap = True, noclasses = True,
+                                                       style = style)
+                data = highlight(blob.data, lexer, _formatters[style])
+        except:
+            self._setDegraded()
+            return None
+
+        if key:
+            self._highlightCachePut(key, data)
+        return data
+
+    def _highlightInPool(self, blob, lexer, style):
+        """ Highlights blob in helper process (see highlighter.py),
+            returns None if it takes longer than highlight_timeout seconds.
+            Time of each job and number of queued jobs are logged, so
+            highlight_processes can be sized.
+        """
+        data, queue, elapsed = highlighter.highlight(blob.data, lexer, style,
+                                                     self._highlight_processes,
+                                                     self._highlight_timeout)
+        if data is None:
+            msg  = 'pitweb: highlighting of blob {0} timed out after {1:.1f} s'
+            msg += ' (queue {2}, processes {3})'
+            msg  = msg.format(blob.id, elapsed, queue, self._highlight_processes)
+            self._req.log_error(msg, apache.APLOG_WARNING)
+        else:
+            msg  = 'pitweb: highlighting of blob {0} took {1:.1f} ms'
+            msg += ' (queue {2}, processes {3})'
+            msg  = msg.format(blob.id, elapsed * 1000., queue, self._highlight_processes)
+            self._req.log_error(msg, apache.APLOG_INFO)
+        return data
+
+    def _lexer(self, filename):
+        """ Returns pygments lexer for file or None """
+        name = os.path.basename(filename)
+
+        lexer = lexer_cache.get(name)
+        if lexer is None:
             try:
-                lexer     = get_lexer_for_filename(filename)
-                formatter = HtmlFormatter(nowrap = True, noclasses = True, style = 'trac')
-                data = highlight(data, lexer, formatter)
+                lexer = get_lexer_for_filename(name)
             except:
-                lexer     = None
-                formatter = None
+                lexer = False
+            lexer_cache.put(name, lexer)
 
-        lines = data.split('\n')
-        if len(lines[-1]) == 0:
-            lines = lines[:-1]
+        if not lexer:
+            return None
+        return lexer
+
+    def _highlightCache(self):
+        if not self._cache_dir:
+            return None
+        return cache.DiskCache(os.path.join(self._cache_dir, 'highlight'),
+                               self._highlight_cache_size)
+
+    def _highlightCacheGet(self, key):
+        disk = self._highlightCache()
+        if disk is None:
+            return highlight_cache.get(key)
+        return disk.read(key)
+
+    def _highlightCachePut(self, key, data):
+        disk = self._highlightCache()
+        if disk is None:
+            highlight_cache.put(key, data)
+            return
+
+        try:
+            disk.put(key, data)
+        except (IOError, OSError):
+            pass
+
+    def _fBlob(self, lines, first, total):
+        """ Returns HTML of lines of blob (see _blobLines()), the first one
+            is line first (counted from 1) of total lines.
+        """
+        html = ''
 
         digits = 0
-        if len(lines) > 0:
-            digits = int(math.ceil(math.log(len(lines), 10)))
+        if total > 0:
+            digits = int(math.ceil(math.log(total, 10)))
 
         linepat = '<div class="blob-line">'
         linepat += '<span class="blob-linenum"> {{0: >{0}d}} </span>'
@@ -550,13 +1062,9 @@ class Project(ProjectBase):
         linepat += '</div>'
         linepat = linepat.format(digits)
 
-        if not lexer:
-            lines = map(lambda x: self._esc(x), lines)
-
         html += '<div class="blob">'
-        for i in range(0, len(lines)):
-            line = lines[i]
-            html += linepat.format(i + 1, line)
+        for i, line in enumerate(lines):
+            html += linepat.format(first + i, line)
         html += '</div>'
 
         return html
@@ -623,15 +1131,13 @@ class Project(ProjectBase):
         </tr>
         '''
         for h in heads:
-            comm = h.commit()
-
-            line = self._esc(comm.commentFirstLine())
+            line = self._esc(h.subject)
             if len(line) > self._one_line_comment_max_len:
                 line = line[:self._one_line_comment_max_len] + '...'
             line = line.replace('{', '{{').replace('}', '}}')
 
             v = { 'a'  : 'log',
-                  'id' : comm.id }
+                  'id' : h.id }
             commanchor = self.anchor(line, v = v, cls = 'comment')
 
             v = { 'a' : 'log',
@@ -641,9 +1147,9 @@ class Project(ProjectBase):
             html += '<tr>'
             html += '<td>' + nameanchor + '</td>'
             html += '<td>' + commanchor + '</td>'
-            html += '<td><i>' + comm.author.name() + '</i></td>'
-            html += '<td title="' + comm.author.date.format('%Y-%m-%d %H:%M:%S') +'">'
-            html +=   comm.author.date.format('%Y-%m-%d')
+            html += '<td><i>' + h.author.name() + '</i></td>'
+            html += '<td title="' + h.author.date.format('%Y-%m-%d %H:%M:%S') +'">'
+            html +=   h.author.date.format('%Y-%m-%d')
             html += '</td>'
             html += '<td>' + '</td>'
             html += '</tr>'
@@ -704,15 +1210,13 @@ class Project(ProjectBase):
         </tr>
         '''
         for r in remotes:
-            comm = r.commit()
-
-            line = self._esc(comm.commentFirstLine())
+            line = self._esc(r.subject)
             if len(line) > self._one_line_comment_max_len:
                 line = line[:self._one_line_comment_max_len] + '...'
             line = line.replace('{', '{{').replace('}', '}}')
 
             v = { 'a'  : 'log',
-                  'id' : comm.id }
+                  'id' : r.id }
             commanchor = self.anchor(line, v = v, cls = 'comment')
 
             v = { 'a' : 'log',
@@ -722,9 +1226,9 @@ class Project(ProjectBase):
             html += '<tr>'
             html += '<td>' + nameanchor + '</td>'
             html += '<td>' + commanchor + '</td>'
-            html += '<td><i>' + self._esc(comm.author.name()) + '</i></td>'
-            html += '<td title="' + comm.author.date.format('%Y-%m-%d %H:%M:%S') + '">'
-            html +=   comm.author.date.format('%Y-%m-%d')
+            html += '<td><i>' + self._esc(r.author.name()) + '</i></td>'
+            html += '<td title="' + r.author.date.format('%Y-%m-%d %H:%M:%S') + '">'
+            html +=   r.author.date.format('%Y-%m-%d')
             html += '</td>'
             html += '<td>' + '</td>'
             html += '</tr>'
@@ -767,15 +1271,18 @@ class Project(ProjectBase):
         return html
 
 
-    def _fLog(self, commits, id = 'HEAD', longcomment = False, showmsg = False, page = 1):
+    def _fLog(self, commits, id = 'HEAD', longcomment = False, showmsg = False, page = 1,
+                    cursor = None, listed = None):
         html = ''
 
         expand = ''
         if longcomment:
             if not showmsg:
-                expand = self.anchorLog('Expand', id, not showmsg, page)
+                expand = self.anchorLog('Expand', id, not showmsg, page, cursor = cursor,
+                                        listed = listed)
             else:
-                expand = self.anchorLog('Collapse', id, not showmsg, page)
+                expand = self.anchorLog('Collapse', id, not showmsg, page, cursor = cursor,
+                                        listed = listed)
             expand = ' (' + expand + ')'
 
         html += '''
@@ -1095,7 +1602,7 @@ class Project(ProjectBase):
 
         header += '<span class="project">{project_name}</span>'.format(project_name = self._project_name)
 
-        sections = ['summary', 'log', 'refs', 'commit', 'diff', 'tree']
+        sections = ['summary', 'log', 'refs', 'commit', 'diff', 'tree', 'find']
         menu = ''
         for sec in sections:
             cls = ''
@@ -1186,6 +1693,10 @@ div.commit-msg { font-family: monospace; white-space: pre; }
 div.log_nav { margin: 10px; }
 div.log_nav span.sep { margin-left: 5px; margin-right: 5px; }
 div.log_nav span { color: #555555; }
+div.blob_nav { margin: 10px; }
+div.blob_nav span.sep { margin-left: 5px; margin-right: 5px; }
+div.blob_nav span { color: #555555; }
+form.blob_nav { display: inline; }
 table.log tr.log_header { font-weight: bold; font-size: 15px; }
 
 table.refs a.head { font-weight: bold; color: #469446; }
@@ -0,0 +1,118 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import os
+import threading
+
+
+# Configurations loaded by the current process, keyed by pathname of config
+# file: path -> (fingerprint, config, error)
+_configs = {}
+_configs_lock = threading.Lock()
+
+def _fingerprint(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino, )
+
+def fingerprint(dir):
+    """ Returns value which changes whenever configuration file of project
+        in dir changes (None if there is no configuration file).
+    """
+    return _fingerprint(os.path.join(dir, 'pitweb.py'))
+
+def _load(path):
+    config = None
+    error  = None
+
+    try:
+        glob = { '__name__' : 'pitweb_config',
+                 '__file__' : path }
+        execfile(path, glob)
+
+        config = {}
+        for name, value in glob.iteritems():
+            if name[:2] != '__':
+                config[name] = value
+    except Exception as e:
+        error  = "Can't load configuration file: "
+        error += str(e)
+
+    return (config, error, )
+
+def load(dir):
+    """ Loads configuration file pitweb.py from project directory dir.
+        Returns tuple (config, error) where config is dictionary of
+        parameters or None if there is no configuration file or it can't be
+        loaded and error is error message or None.
+
+        Loaded configurations are cached until the file changes, returned
+        dictionary is shared and must not be modified.
+    """
+    path = os.path.join(dir, 'pitweb.py')
+    fp = _fingerprint(path)
+    if fp is None:
+        return (None, None, )
+
+    _configs_lock.acquire()
+    try:
+        cached = _configs.get(path)
+        if cached and cached[0] == fp:
+            return cached[1:]
+    finally:
+        _configs_lock.release()
+
+    config, error = _load(path)
+
+    _configs_lock.acquire()
+    try:
+        _configs[path] = (fp, config, error, )
+    finally:
+        _configs_lock.release()
+
+    return (config, error, )
+
+def param(config, name, default):
+    if config is None:
+        return default
+    return config.get(name, default)
+
+def projectName(dir, config):
+    """ Returns name of project: project_name from config or name of its
+        directory without .git suffix.
+    """
+    name = param(config, 'project_name', None)
+    if name:
+        return name
+
+    name = ''
+
+    p = dir.split('/')
+    p = filter(lambda x: len(x) > 0, p)
+    if len(p) > 0:
+        name = p[-1]
+        if len(name) > 4 and name[-4:] == '.git':
+            name = name[:-4]
+
+    return name
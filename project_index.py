@@ -0,0 +1,226 @@
+##
+# pitweb - Web interface for git repository written in python
+# ------------------------------------------------------------
+# Copyright (c)2010 Daniel Fiser <danfis@danfis.cz>
+#
+#
+#  This file is part of pitweb.
+#
+#  pitweb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as
+#  published by the Free Software Foundation; either version 3 of
+#  the License, or (at your option) any later version.
+#
+#  pitweb is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+import os
+import sys
+import time
+import hashlib
+import sqlite3
+import threading
+
+import git
+import project_config
+
+
+# Results of projectDirs() of the current process, keyed by parent
+# directory: parent_dir -> (mtime, time of scan, dirs)
+_scans = {}
+_scans_lock = threading.Lock()
+
+def _scan(parent_dir):
+    dirs = []
+
+    for dir in sorted(os.listdir(parent_dir), key=str.lower):
+        path   = os.path.join(parent_dir, dir)
+        config = os.path.join(path, 'pitweb.py')
+        if os.path.isdir(path) and os.path.isfile(config):
+            dirs.append(path)
+
+    return dirs
+
+def projectDirs(parent_dir, max_age = 60.):
+    """ Returns list of directories of projects located in parent_dir. All
+        subdirectories which contain config file (pitweb.py) are taken as
+        project.
+
+        Result is cached and parent_dir is scanned again only when its
+        mtime changes (a repository is added, removed or renamed) or when
+        the result is older than max_age seconds (adding config file into
+        existing repository doesn't change mtime of parent_dir).
+    """
+    mtime = os.stat(parent_dir).st_mtime
+    now = time.time()
+
+    _scans_lock.acquire()
+    try:
+        cached = _scans.get(parent_dir)
+        if cached and cached[0] == mtime and now - cached[1] < max_age:
+            return list(cached[2])
+    finally:
+        _scans_lock.release()
+
+    dirs = _scan(parent_dir)
+
+    _scans_lock.acquire()
+    try:
+        _scans[parent_dir] = (mtime, now, dirs, )
+    finally:
+        _scans_lock.release()
+
+    return list(dirs)
+
+def fingerprint(dir):
+    """ Returns string which changes whenever refs or configuration of
+        project in dir change.
+    """
+    fp = [git.refsFingerprint(dir)]
+    try:
+        st = os.stat(os.path.join(dir, 'pitweb.py'))
+        fp.append((st.st_ino, st.st_mtime, st.st_size))
+    except OSError:
+        fp.append(None)
+    return hashlib.sha1(repr(fp)).hexdigest()
+
+
+def projectConfigInfo(dir):
+    """ Returns tuple (name, owner, description) of project in dir """
+    config, error = project_config.load(dir)
+    name  = project_config.projectName(dir, config)
+    owner = project_config.param(config, 'owner', None) or ''
+    desc  = project_config.param(config, 'description', None) or ''
+    return (name, owner, desc, )
+
+def projectInfo(dir):
+    """ Returns tuple (name, owner, description, last_change) of project in
+        dir, last_change is time of the most recent commit (seconds since
+        epoch) or None.
+    """
+    last_change = None
+    for commit in git.Git(dir).revListIter(None, all = True, max_count = 1):
+        last_change = commit.committer.date.epoch
+
+    return projectConfigInfo(dir) + (last_change, )
+
+
+class ProjectIndex(object):
+    """ Persistent index of projects (stored in SQLite database path).
+
+        For each project it holds name, owner, description and time of last
+        change together with fingerprint of its refs, so the projects list
+        can be rendered without running git. Only projects whose
+        fingerprint changed are recomputed by refresh().
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, timeout = 30)
+        self._db.text_factory = str
+        self._db.execute('''CREATE TABLE IF NOT EXISTS projects (
+                                dir         TEXT PRIMARY KEY,
+                                name        TEXT,
+                                owner       TEXT,
+                                description TEXT,
+                                last_change INTEGER,
+                                fingerprint TEXT)''')
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def stale(self, dirs, rebuild = False):
+        """ Returns tuple (stale, removed) where stale is list of pairs
+            (dir, fingerprint) of projects from dirs which have to be
+            recomputed (all of them if rebuild is True) and removed is list
+            of directories in index which are not in dirs.
+        """
+        fps = dict(self._db.execute('SELECT dir, fingerprint FROM projects'))
+
+        stale = []
+        for dir in dirs:
+            fp = fingerprint(dir)
+            if rebuild or fps.get(dir) != fp:
+                stale.append((dir, fp, ))
+
+        removed = list(set(fps.keys()) - set(dirs))
+        return (stale, removed, )
+
+    def store(self, rows, removed = []):
+        """ Stores rows (dir, name, owner, description, last_change,
+            fingerprint) and removes projects in directories removed in one
+            transaction.
+        """
+        if len(rows) == 0 and len(removed) == 0:
+            return
+
+        cur = self._db.cursor()
+        try:
+            cur.executemany('''INSERT OR REPLACE INTO projects
+                                 (dir, name, owner, description, last_change, fingerprint)
+                               VALUES (?, ?, ?, ?, ?, ?)''', rows)
+            cur.executemany('DELETE FROM projects WHERE dir = ?',
+                            [(dir, ) for dir in removed])
+            self._db.commit()
+        except:
+            self._db.rollback()
+            raise
+
+    def refresh(self, dirs, rebuild = False):
+        """ Updates index so it contains exactly projects from dirs.
+            Projects whose fingerprint didn't change are skipped unless
+            rebuild is True. Returns number of updated projects.
+        """
+        stale, removed = self.stale(dirs, rebuild)
+
+        # git is run for all changed projects before anything is written,
+        # so the database is locked only for the short write at the end
+        rows = []
+        for dir, fp in stale:
+            rows.append((dir, ) + projectInfo(dir) + (fp, ))
+
+        self.store(rows, removed)
+        return len(rows) + len(removed)
+
+    def projects(self, order = 'name'):
+        """ Returns list of tuples (dir, name, owner, description,
+            last_change) sorted by name or by last change (order = 'age',
+            the most recent first).
+        """
+        sql = 'SELECT dir, name, owner, description, last_change FROM projects '
+        if order == 'age':
+            sql += 'ORDER BY last_change IS NULL, last_change DESC'
+        else:
+            sql += 'ORDER BY lower(name)'
+
+        return self._db.execute(sql).fetchall()
+
+
+def main(argv):
+    usage = 'Usage: {0} [--rebuild] parent_dir index_file'.format(argv[0])
+
+    rebuild = False
+    args = argv[1:]
+    if len(args) > 0 and args[0] == '--rebuild':
+        rebuild = True
+        args = args[1:]
+
+    if len(args) != 2:
+        print >>sys.stderr, usage
+        return 1
+
+    index = ProjectIndex(args[1])
+    updated = index.refresh(_scan(args[0]), rebuild = rebuild)
+    index.close()
+
+    print '{0} project(s) updated'.format(updated)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
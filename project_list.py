@@ -22,13 +22,45 @@
 
 from mod_python import apache, util
 import os
+import time
+import datetime
+import sqlite3
+import threading
+from multiprocessing.pool import ThreadPool
 
 from project import Project
+from project_index import ProjectIndex, projectDirs, projectInfo, \
+                          projectConfigInfo
+import project_config
 import common
+import git
+
+
+# Thread pools shared by all requests handled by the current process,
+# keyed by number of threads
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _pool(threads):
+    _pools_lock.acquire()
+    try:
+        if threads not in _pools:
+            _pools[threads] = ThreadPool(threads)
+        return _pools[threads]
+    finally:
+        _pools_lock.release()
 
 
 class ProjectListBase(common.ModPythonOutput):
-    def __init__(self, req, projects = [], basepath = '/'):
+    """ List of projects.
+
+        Last changes of projects are gathered in parallel using threads
+        threads. If last change of a project is not known within timeout
+        seconds, placeholder is shown instead.
+    """
+
+    def __init__(self, req, projects = [], basepath = '/', threads = 8,
+                       timeout = 5.):
         super(ProjectListBase, self).__init__(req)
 
         # set default content-type to text/html
@@ -36,6 +68,8 @@ class ProjectListBase(common.ModPythonOutput):
 
         self._projects = projects
         self._basepath = basepath
+        self._threads  = threads
+        self._timeout  = timeout
 
 
     def _uri(self):
@@ -43,33 +77,73 @@ class ProjectListBase(common.ModPythonOutput):
         uri = filter(lambda x: len(x) > 0, uri)
         return uri
 
+    def projects(self):
+        """ Returns list of all projects """
+        return self._projects
+
+    def _project(self, name):
+        """ Returns project called name or None """
+        for p in self.projects():
+            if name == p.projectName():
+                return p
+        return None
+
     def run(self):
         uri = self._uri()
         if len(uri) > 0:
-            prj_name = uri[-1]
-            for p in self._projects:
-                if prj_name == p.projectName():
-                    return p.run()
+            prj = self._project(uri[-1])
+            if prj is not None:
+                return prj.run()
 
         self.write(self.tpl(self._fProjectList()))
         return apache.OK
 
+    def _order(self):
+        """ Returns order of projects requested by argument o (name or
+            age)
+        """
+        args = self._req.args or ''
+        for hunk in args.lstrip('?').replace('&', ';').split(';'):
+            s = hunk.split('=', 1)
+            if len(s) == 2 and s[0] == 'o' and s[1] in ['name', 'age']:
+                return s[1]
+        return 'name'
+
+    def _rows(self, order):
+        """ Returns list of tuples (name, owner, description, last change)
+            of all projects sorted according to order.
+        """
+        projects = self.projects()
+        last_changes = self._lastChanges(projects)
+
+        rows = []
+        for prj, last_change in zip(projects, last_changes):
+            rows.append((prj.projectName(), prj.owner(), prj.description(),
+                         last_change))
+
+        if order == 'age':
+            # dates are formated as %Y-%m-%d %H:%M:%S so they can be
+            # compared as strings, placeholders end up at the bottom
+            rows.sort(key = lambda r: r[3], reverse = True)
+
+        return rows
+
     def _fProjectList(self):
         html = ''
         html += '<table class="projects">'
 
         html += '<tr class="header">'
-        html += '<td>Project</td>'
+        html += '<td><a href="?o=name">Project</a></td>'
         html += '<td>Owner</td>'
         html += '<td>Description</td>'
-        html += '<td>Last change</td>'
+        html += '<td><a href="?o=age">Last change</a></td>'
         html += '</tr>'
 
-        for prj in self._projects:
-            name        = self._esc(prj.projectName())
-            owner       = self._esc(prj.owner())
-            desc        = self._esc(prj.description())
-            last_change = self._esc(prj.lastChange())
+        for name, owner, desc, last_change in self._rows(self._order()):
+            name        = self._esc(name)
+            owner       = self._esc(owner)
+            desc        = self._esc(desc)
+            last_change = self._esc(last_change)
 
             html += '<tr>'
             html += '<td><a href="{0}{1}">{1}</a></td>'.format(self._basepath, name)
@@ -81,6 +155,65 @@ class ProjectListBase(common.ModPythonOutput):
         html += '</table>'
         return html
         
+    def _lastChanges(self, projects, placeholder = '...'):
+        """ Returns list of last changes of projects (see _parallel()) """
+        return self._parallel(lambda prj: prj.lastChange(), projects,
+                              placeholder)
+
+    def _parallel(self, fn, items, placeholder):
+        """ Returns list of results of fn called for each of items. Calls
+            run in parallel, each one gets self._timeout seconds from the
+            time it started (or from the beginning if it didn't start
+            yet), placeholder is used for calls which didn't make it.
+
+            Git processes of calls which run out of time are killed and
+            calls which didn't start in time are skipped, so threads of
+            the shared pool are released for other requests.
+        """
+        if self._threads <= 1:
+            return [fn(item) for item in items]
+
+        deadline = time.time() + self._timeout
+
+        def job(item, started, group):
+            if group.killed or time.time() > deadline:
+                return placeholder
+
+            started.append(time.time())
+            git.trackProcesses(group)
+            try:
+                return fn(item)
+            finally:
+                git.trackProcesses(None)
+
+        pool = _pool(self._threads)
+        jobs = []
+        for item in items:
+            started = []
+            group = git.ProcessGroup()
+            res = pool.apply_async(job, (item, started, group))
+            jobs.append((res, started, group))
+
+        out = []
+        for res, started, group in jobs:
+            while not res.ready():
+                d = deadline
+                if started and started[0] <= deadline:
+                    d = max(d, started[0] + self._timeout)
+
+                now = time.time()
+                if now >= d:
+                    break
+                res.wait(d - now)
+
+            if res.ready() and res.successful():
+                out.append(res.get())
+            else:
+                group.kill()
+                out.append(placeholder)
+
+        return out
+
     def tpl(self, content):
         html = '''
 <html>
@@ -134,20 +267,102 @@ class ProjectListDir(ProjectListBase):
     """ List of projects is based on one directory.
         All subdirectories which contain config file (piteweb.py) are taken
         as project.
+
+        If index (pathname of SQLite database) is given, names, owners,
+        descriptions and last changes of projects are kept there (see
+        project_index.py) and projects page is rendered from one query
+        instead of asking every repository. Only projects whose refs or
+        configuration changed are asked, in parallel with the same time
+        limit as without index.
+
+        Projects are constructed lazily, a request for one project loads
+        only configuration of that project (unless its name differs from
+        name of its directory).
     """
 
-    def __init__(self, req, dir, basepath = '/'):
-        projects = self._projects(req, dir, basepath)
-        super(ProjectListDir, self).__init__(req, projects, basepath = basepath)
+    def __init__(self, req, dir, basepath = '/', threads = 8, timeout = 5.,
+                       index = None):
+        super(ProjectListDir, self).__init__(req, None, basepath = basepath,
+                                             threads = threads, timeout = timeout)
+
+        self._dirs  = projectDirs(dir)
+        self._index = index
+
+    def projects(self):
+        if self._projects is None:
+            self._projects = [Project(self._req, path, self._basepath) \
+                                for path in self._dirs]
+        return self._projects
+
+    def _project(self, name):
+        # directories whose name matches are tried first, the rest only if
+        # the project is renamed by project_name in its config
+        first = []
+        rest  = []
+        for dir in self._dirs:
+            if project_config.projectName(dir, None) == name:
+                first.append(dir)
+            else:
+                rest.append(dir)
+
+        for dir in first + rest:
+            config, error = project_config.load(dir)
+            if project_config.projectName(dir, config) == name:
+                return Project(self._req, dir, self._basepath)
+        return None
+
+    def _rows(self, order):
+        if self._index is None:
+            return super(ProjectListDir, self)._rows(order)
+
+        placeholder = '...'
+        try:
+            index = ProjectIndex(self._index)
+            try:
+                stale, removed = index.stale(self._dirs)
+
+                # changed projects are asked in parallel, the ones which
+                # don't make it in time stay stale and are shown with
+                # placeholder
+                infos = self._parallel(projectInfo, [s[0] for s in stale],
+                                       placeholder)
+                store = []
+                late  = []
+                for (dir, fp), info in zip(stale, infos):
+                    if info is placeholder:
+                        late.append(dir)
+                    else:
+                        store.append((dir, ) + info + (fp, ))
+                index.store(store, removed)
+
+                rows = index.projects(order)
+            finally:
+                index.close()
+        except sqlite3.Error as e:
+            self._req.log_error('pitweb: project index {0}: {1}'.format(self._index, e),
+                                apache.APLOG_WARNING)
+            return super(ProjectListDir, self)._rows(order)
 
-    def _projects(self, req, parent_dir, basepath):
-        projects = []
+        out = []
+        for dir, name, owner, desc, last_change in rows:
+            if dir in late:
+                last_change = placeholder
+            elif last_change is None:
+                last_change = ''
+            else:
+                last_change = datetime.datetime.fromtimestamp(last_change)
+                last_change = last_change.strftime('%Y-%m-%d %H:%M:%S')
+            out.append((name, owner, desc, last_change))
 
-        dirs = sorted(os.listdir(parent_dir), key=str.lower)
-        for dir in dirs:
-            path   = os.path.join(parent_dir, dir)
-            config = os.path.join(path, 'pitweb.py')
-            if os.path.isdir(path) and os.path.isfile(config):
-                projects.append(Project(req, path, basepath))
+        # projects which are not in index yet
+        known = set([r[0] for r in rows])
+        for dir in late:
+            if dir not in known:
+                out.append(projectConfigInfo(dir) + (placeholder, ))
+        if order == 'age':
+            # see ProjectListBase._rows()
+            out.sort(key = lambda r: r[3], reverse = True)
+        else:
+            out.sort(key = lambda r: r[0].lower())
 
-        return projects
+        return out